@@ -1,107 +1,230 @@
-from flask import Flask, request, jsonify
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
 import os
 import logging
 import sys
-import time
 import threading
+import hashlib
+import hmac
+import atexit
+import json
+import gc
 from functools import wraps
-from datetime import datetime, timedelta
-from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # ✅ Configure logging FIRST (before any logger usage)
+# Records go to stdout through a background writer thread (LOG_MODE) and payload-level
+# messages are sampled (LOG_PAYLOAD_SAMPLING) - see log_config.py
+from log_config import configure_logging, stop_logging, get_logging_stats
 env = os.getenv('FLASK_ENV', 'development')
-logging.basicConfig(
-    level=logging.DEBUG if env == 'development' else logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)  # Ensure logs go to stdout for Render
-    ]
-)
+configure_logging(logging.DEBUG if env == 'development' else logging.INFO)
+atexit.register(stop_logging)
 logger = logging.getLogger(__name__)
 
 # ✅ Import model manager for lazy loading
-from models.model_manager import get_model, get_model_status, is_model_ready
-
-# ✅ Import recommendation functions (models load lazily on first use)
-from models.diet_recommender import get_diet_recommendations
-from models.stress_analysis import analyze_stress
-from models.workout_recommender import get_workout_recommendations
+from models.model_manager import (
+    get_model, get_model_status, is_model_ready, get_scheduler_stats, get_readiness,
+    get_recommender, warm_imports, get_import_timings,
+    MODEL_NAMES, get_model_version, reload_models_async, start_reload_watcher, track_model_versions
+)
+from models.profile import get_profile_memo_stats
+from models.workout_history import WorkoutHistory
+from models.metrics import REQUEST_SECONDS, CONTENT_TYPE, format_family, render_histograms
 
 # ✅ Bounded LRU cache with TTL - prevents memory leaks on free tier
-class BoundedTTLCache:
-    """LRU cache with TTL and max size to prevent memory unbounded growth"""
-    def __init__(self, max_size=100, ttl_minutes=5):
-        self.max_size = max_size
-        self.ttl = timedelta(minutes=ttl_minutes)
-        self._cache = OrderedDict()  # Preserves insertion order for LRU eviction
-        self._lock = False  # Simple lock for thread safety (GIL handles basic cases)
-    
-    def _cleanup_expired(self):
-        """Remove expired entries"""
-        now = datetime.now()
-        expired_keys = [
-            k for k, (v, ts) in self._cache.items() 
-            if now - ts > self.ttl
-        ]
-        for k in expired_keys:
-            del self._cache[k]
-            logger.debug(f"Cache expired for {k}")
-        return len(expired_keys)
-    
-    def get(self, key):
-        """Get cached result if not expired - moves to end (most recently used)"""
-        if key in self._cache:
-            result, timestamp = self._cache[key]
-            if datetime.now() - timestamp < self.ttl:
-                # Move to end (most recently used)
-                self._cache.move_to_end(key)
-                logger.debug(f"Cache hit for {key}")
-                return result
-            else:
-                logger.debug(f"Cache expired for {key}")
-                self._cache.pop(key, None)  # Safe delete (handles race condition)
+from response_cache import (
+    BoundedTTLCache, SharedMemoryCache, default_shared_cache_path, read_snapshot, snapshot_lock,
+    write_snapshot
+)
+
+# ✅ Per-user trend state for incremental /api/stress requests (stdlib sqlite3)
+from trend_store import TrendStore
+
+# ✅ Recommendation modules (and numpy/sklearn with them) are imported on first use via
+# get_recommender(), or ahead of time by warm_imports() - the app starts on stdlib + Flask
+
+# OPTIMIZED: Bounded cache (100 entries by default). Keys are content-addressed (see get_cache_key),
+# so a longer TTL no longer risks serving another check-in's answer.
+CACHE_TTL_MINUTES = float(os.getenv('CACHE_TTL_MINUTES', 15))
+CACHE_MAX_SIZE = int(os.getenv('CACHE_MAX_SIZE', 100))
+# 'memory' (per worker) or 'shared' (one memory-mapped cache for all workers on the host)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').lower()
+
+def _create_cache():
+    """Build the response cache for the configured backend"""
+    if CACHE_BACKEND == 'shared':
+        try:
+            cache = SharedMemoryCache(
+                path=os.getenv('CACHE_SHM_PATH', default_shared_cache_path()),
+                max_size=CACHE_MAX_SIZE,
+                ttl_minutes=CACHE_TTL_MINUTES,
+                slot_bytes=int(os.getenv('CACHE_SHM_SLOT_BYTES', 8192))
+            )
+            logger.info(f"💾 Using shared response cache at {cache.path}")
+            return cache
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning(f"⚠️ Shared response cache unavailable ({e}), using in-process cache")
+    return BoundedTTLCache(max_size=CACHE_MAX_SIZE, ttl_minutes=CACHE_TTL_MINUTES)
+
+_cache = _create_cache()
+
+# Optional snapshot of unexpired responses, written when a worker exits and
+# reloaded when the next one starts so recycled workers start warm
+CACHE_SNAPSHOT_PATH = os.getenv('CACHE_SNAPSHOT_PATH')
+
+def save_cache_snapshot(path=None):
+    """
+    Write the cache's unexpired entries to the snapshot file.
+    Entries already in the file (saved by other workers) are kept unless
+    this worker holds a newer copy, up to the cache's max size. The read-merge-write
+    holds a file lock, so workers exiting at the same time merge one after another.
+    Returns the number of entries written.
+    """
+    path = path or CACHE_SNAPSHOT_PATH
+    if not path or not hasattr(_cache, 'entries'):
+        return 0
+    try:
+        entries = _cache.entries()
+        own_keys = {key for key, _, _ in entries}
+        with snapshot_lock(path):
+            now = time.time()
+            others = [
+                entry for entry in read_snapshot(path)
+                if entry[0] not in own_keys and entry[2] > now
+            ]
+            merged = (others + entries)[-CACHE_MAX_SIZE:]
+            write_snapshot(path, merged)
+        logger.info(f"💾 Saved {len(merged)} cached responses to {path}")
+        return len(merged)
+    except Exception as e:
+        logger.error(f"❌ Failed to save cache snapshot: {e}")
+        return 0
+
+def restore_cache_snapshot(path=None):
+    """Load unexpired entries from the snapshot file with their remaining TTL"""
+    path = path or CACHE_SNAPSHOT_PATH
+    if not path or not hasattr(_cache, 'load_entries'):
+        return 0
+    loaded = _cache.load_entries(read_snapshot(path))
+    if loaded:
+        logger.info(f"💾 Restored {loaded} cached responses from {path}")
+    return loaded
+
+# With SHARED_MODELS=true gunicorn imports the app once, in the master, and every worker
+# (including replacements of recycled ones) is forked from it - so the snapshot is read in
+# gunicorn.conf.py's post_worker_init instead, where it picks up what exited workers saved
+SHARED_MODELS = os.getenv('SHARED_MODELS', 'false').lower() == 'true'
+if not SHARED_MODELS:
+    restore_cache_snapshot()
+
+# SQLite file holding per-user trend state; unset disables incremental /api/stress requests
+TREND_STORE_PATH = os.getenv('TREND_STORE_PATH')
+_trend_store = TrendStore(TREND_STORE_PATH) if TREND_STORE_PATH else None
+
+# Numeric inputs are rounded to this many decimals before hashing,
+# so float noise from clients doesn't split otherwise identical requests
+CACHE_KEY_PRECISION = 2
+
+def _quantize(value):
+    """Round numbers for the cache key, pass anything else through"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(float(value), CACHE_KEY_PRECISION)
+    return value
+
+def _profile_fields(data):
+    """Profile fields every recommender reads. The date is included because age depends on it."""
+    user_data = data.get('user_data') or {}
+    return {
+        'dateOfBirth': user_data.get('dateOfBirth'),
+        'gender': user_data.get('gender', 'other'),
+        'today': datetime.now().date().isoformat()
+    }
+
+def _digest(value):
+    """Stable 128-bit hash of a JSON-serializable value"""
+    canonical = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+def _diet_key_fields(data):
+    daily_intake = data.get('daily_intake') or {}
+    macronutrients = daily_intake.get('macronutrients') or {}
+    return {
+        'intake': [
+            _quantize(daily_intake.get('calories', 0)),
+            _quantize(macronutrients.get('protein', 0)),
+            _quantize(macronutrients.get('carbohydrates', 0)),
+            _quantize(macronutrients.get('fats', 0))
+        ],
+        'history': _digest([log.get('timestamp') for log in data.get('nutrition_logs') or []]),
+        'utc_offset': data.get('utc_offset_minutes')
+    }
+
+def _stress_key_fields(data):
+    check_in = data.get('current_check_in') or {}
+    return {
+        'check_in': [
+            check_in.get('mood'),
+            _quantize(check_in.get('stressLevel')),
+            _quantize(check_in.get('sleepQuality'))
+        ] if check_in else None,
+        'history': _digest([
+            [log.get('date'), log.get('mood'), _quantize(log.get('stressLevel')), _quantize(log.get('sleepQuality'))]
+            for log in data.get('daily_logs') or []
+        ])
+    }
+
+def _workout_key_fields(data):
+    stats = data.get('current_stats') or {}
+    history = data.get('workout_history') or []
+    return {
+        'stats': [
+            stats.get('activityType', ''),
+            _quantize(stats.get('duration', 0)),
+            _quantize(stats.get('heartRate', 0)),
+            _quantize(stats.get('caloriesBurned', 0)),
+            _quantize(stats.get('workoutCount', 1))
+        ],
+        'history': _digest([
+            [workout.get('date'), workout.get('activityType'), _quantize(workout.get('duration', 0))]
+            for workout in history
+        ]),
+        # Calendar windows and the 24h recovery advice move with the clock, not just the date
+        'clock': WorkoutHistory(history).clock_state(datetime.now())
+    }
+
+# Model-relevant payload fields per endpoint
+_CACHE_KEY_FIELDS = {
+    'diet': _diet_key_fields,
+    'stress': _stress_key_fields,
+    'workout': _workout_key_fields
+}
+
+def get_cache_key(endpoint, data):
+    """
+    Generate a content-addressed cache key from the fields that affect the response,
+    for the model version currently served.
+    Returns None when the payload can't be canonicalized (the request is then not cached).
+    """
+    return _cache_key_for(endpoint, data, get_model_version(endpoint))
+
+def _cache_key_for(endpoint, data, model_version):
+    """Cache key of a response computed by the given model version"""
+    # Incremental requests update per-user state - a cached answer would skip the update
+    if isinstance(data, dict) and data.get('incremental'):
+        return None
+    try:
+        fields = _CACHE_KEY_FIELDS[endpoint](data)
+        fields['profile'] = _profile_fields(data)
+        # A hot-reloaded model gets new keys, so responses from the old version are never served
+        fields['model_version'] = model_version
+        return f"{endpoint}:{_digest(fields)}"
+    except (AttributeError, TypeError, KeyError) as e:
+        logger.debug("[%s] Payload not cacheable: %s", endpoint, e)
         return None
-    
-    def set(self, key, result):
-        """Cache result with timestamp - evicts oldest if at capacity"""
-        # Check if key exists (update case)
-        if key in self._cache:
-            self._cache.move_to_end(key)
-        elif len(self._cache) >= self.max_size:
-            # Evict oldest (first item in OrderedDict)
-            oldest_key = next(iter(self._cache))
-            del self._cache[oldest_key]
-            logger.debug(f"Cache evicted {oldest_key} (max size reached)")
-        
-        self._cache[key] = (result, datetime.now())
-        logger.debug(f"Cached result for {key} (size: {len(self._cache)})")
-    
-    def clear(self):
-        """Clear all cached entries"""
-        self._cache.clear()
-    
-    def size(self):
-        """Get current cache size"""
-        return len(self._cache)
-    
-    def stats(self):
-        """Get cache statistics"""
-        expired = self._cleanup_expired()
-        return {
-            'size': len(self._cache),
-            'max_size': self.max_size,
-            'ttl_minutes': self.ttl.total_seconds() / 60,
-            'expired_cleaned': expired
-        }
-
-# OPTIMIZED: Bounded cache with 100 entries max, 5 min TTL
-_cache = BoundedTTLCache(max_size=100, ttl_minutes=5)
-CACHE_TTL_MINUTES = 5  # Kept for backward compatibility
-
-def get_cache_key(endpoint, user_id=None):
-    """Generate cache key for endpoint"""
-    return f"{endpoint}:{user_id or 'anonymous'}"
 
 def get_cached_result(key):
     """Get cached result if not expired"""
@@ -111,40 +234,47 @@ def set_cached_result(key, result):
     """Cache result with timestamp"""
     _cache.set(key, result)
 
+def run_cached(endpoint, data, compute):
+    """
+    Serve compute() - returning result or (result, status) - through the response cache.
+    Returns (result, status, cache_hit). Only 200 results are stored.
+    """
+    user_id = None
+    skip_cache = False
+    cache_key = None
+    if isinstance(data, dict) and data:
+        user_id = data.get('user_id')
+        skip_cache = data.get('skip_cache', False)
+        cache_key = get_cache_key(endpoint, data)
+
+    # Try to get cached result (unless skip_cache is true)
+    if skip_cache:
+        logger.info("[%s] Cache skip requested for user %s", endpoint, user_id)
+    elif cache_key is not None:
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            return cached, 200, True
+
+    # Execute function and cache result
+    with track_model_versions() as versions_used:
+        result = compute()
+    result, status_code = result if isinstance(result, tuple) else (result, 200)
+    if status_code == 200 and cache_key is not None:
+        # Keyed by the version that computed the result (a first request may have loaded
+        # the model, a hot reload may have swapped it) - not the one published by now
+        if endpoint in versions_used:
+            cache_key = _cache_key_for(endpoint, data, versions_used[endpoint])
+        set_cached_result(cache_key, result)
+    return result, status_code, False
+
 def cache_response(endpoint):
     """Decorator to cache endpoint responses"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Get user_id from request if available
-            user_id = None
-            skip_cache = False
-            if request.is_json and request.json:
-                user_id = request.json.get('user_id')
-                skip_cache = request.json.get('skip_cache', False)
-            
-            cache_key = get_cache_key(endpoint, user_id)
-            
-            # Try to get cached result (unless skip_cache is true)
-            if not skip_cache:
-                cached = get_cached_result(cache_key)
-                if cached is not None:
-                    return jsonify(cached), 200
-            else:
-                logger.info(f"[{endpoint}] Cache skip requested for user {user_id}")
-            
-            # Execute function and cache result
-            result = f(*args, **kwargs)
-            
-            # If successful response, cache it
-            if isinstance(result, tuple):
-                data, status_code = result
-                if status_code == 200:
-                    set_cached_result(cache_key, data)
-                return jsonify(data), status_code
-            else:
-                set_cached_result(cache_key, result)
-                return jsonify(result), 200
+            data = request.json if request.is_json else None
+            result, status_code, _ = run_cached(endpoint, data, lambda: f(*args, **kwargs))
+            return jsonify(result), status_code
         return decorated_function
     return decorator
 
@@ -180,6 +310,20 @@ CORS(app, resources={
     }
 })
 
+# ✅ Request latency histogram (see /api/metrics)
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The route pattern, not the raw path, keeps the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+    return response
+
 # ✅ Utility function to validate input data
 def validate_request(req):
     if not req.is_json:
@@ -188,26 +332,181 @@ def validate_request(req):
         return {'error': 'Invalid request: No data provided'}, 400
     return None
 
+# Upper bound on users per batch request - keeps a single request within memory limits
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 500))
+
+def validate_batch_request(req):
+    """Validate a batch request body of the form {"users": [payload, ...]}"""
+    if not req.is_json:
+        return {'error': 'Invalid request: Content-Type must be application/json'}, 400
+    if not isinstance(req.json, dict) or not req.json:
+        return {'error': 'Invalid request: No data provided'}, 400
+    users = req.json.get('users')
+    if not isinstance(users, list) or not users:
+        return {'error': "Invalid request: 'users' must be a non-empty list"}, 400
+    if len(users) > MAX_BATCH_SIZE:
+        return {'error': f'Invalid request: at most {MAX_BATCH_SIZE} users per batch'}, 400
+    if not all(isinstance(user, dict) for user in users):
+        return {'error': "Invalid request: every entry in 'users' must be an object"}, 400
+    return None
+
 @app.route('/api/ping', methods=['GET', 'HEAD'])
 def ping():
     """Lightweight endpoint for keep-alive pings - no model loading"""
     return jsonify({'status': 'alive', 'time': datetime.now().isoformat()}), 200
 
+def process_memory():
+    """
+    This worker's memory split from /proc/self/smaps_rollup, in MB (None off Linux).
+    'shared' pages are also mapped by other processes - e.g. models inherited from the
+    gunicorn master - while 'private' is what this worker alone costs.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    to_mb = lambda kb: round(kb / 1024, 1)
+    return {
+        'pid': os.getpid(),
+        'rss_mb': to_mb(fields.get('Rss', 0)),
+        'pss_mb': to_mb(fields.get('Pss', 0)),
+        'shared_mb': to_mb(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)),
+        'private_mb': to_mb(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0))
+    }
+
+def _prediction_memo_stats():
+    """Memo stats of the recommenders imported so far (health checks never trigger imports)"""
+    stats = {}
+    for model_name in ('diet', 'workout'):
+        if is_model_ready(model_name):
+            stats[model_name] = get_recommender(model_name).get_prediction_memo_stats()
+    return stats
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     # Don't trigger model loading during health check - just report status
     # OPTIMIZED: Use new bounded cache stats method
     cache_info = _cache.stats()
-    cache_info['ttl_minutes'] = CACHE_TTL_MINUTES  # Backward compatibility
     return jsonify({
         'status': 'healthy',
         'environment': env,
         'models': get_model_status(),  # This shows loaded status without triggering load
         'cache': cache_info,
-        'lazy_loading': True,
-        'note': 'Models load on first request to save memory (free tier optimized)'
+        'inference_batching': get_scheduler_stats(),
+        'prediction_memo': _prediction_memo_stats(),
+        'profile_memo': get_profile_memo_stats(),
+        'logging': get_logging_stats(),
+        'trend_store': _trend_store.stats() if _trend_store else {'enabled': False},
+        'startup': {
+            'app_import_ms': APP_IMPORT_MS,
+            'scientific_stack_loaded': 'numpy' in sys.modules,
+            'deferred_imports': get_import_timings()
+        },
+        'ready': get_readiness()[0],  # Liveness only - route traffic with /api/ready
+        'memory': process_memory(),
+        'shared_models': _models_preloaded_in_master,
+        'lazy_loading': not _models_preloaded_in_master,
+        'note': ('Models loaded once in the gunicorn master and shared copy-on-write by all workers'
+                 if _models_preloaded_in_master else
+                 'Models load in the background after the worker starts (or on the first request that needs one)')
     }), 200
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: 503 until every model is loaded and warmed, with the warm
+    per-prediction latency of each model. Read-only - loading is started at startup
+    (start_preload from gunicorn's post_worker_init, or the __main__ block).
+    """
+    ready, models = get_readiness()
+    return jsonify({'ready': ready, 'models': models}), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus text exposition of this worker: request, inference and rule-engine
+    latency histograms, response-cache counters and model load durations.
+    """
+    cache_info = _cache.stats()
+    lines = render_histograms()
+    for counter in ('hits', 'misses', 'expirations', 'evictions'):
+        lines += format_family(
+            f'fitness_ai_response_cache_{counter}_total', 'counter',
+            f'Response cache {counter}', [((), cache_info.get(counter))]
+        )
+    lines += format_family('fitness_ai_response_cache_entries', 'gauge', 'Responses currently cached',
+                           [((), cache_info.get('size'))])
+    lines += format_family(
+        'fitness_ai_model_load_duration_seconds', 'gauge', 'Duration of the last load of each model',
+        sorted(((name,), seconds) for name, seconds in get_model_status()['load_times'].items()),
+        ('model',)
+    )
+    return Response('\n'.join(lines) + '\n', mimetype=None, content_type=CONTENT_TYPE)
+
+# Token required by /api/admin/* endpoints (sent as X-Admin-Token); unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+@app.route('/api/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Hot-reload models from disk in the background: each is loaded, warmed and swapped
+    in atomically while the current version keeps serving. Affects this worker only -
+    MODEL_RELOAD_INTERVAL makes every worker pick up new files on its own.
+    Body (optional): {"models": ["diet", "stress", "workout"]}, defaults to the loaded models.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    body = request.get_json(silent=True)
+    model_names = body.get('models') if isinstance(body, dict) else None
+    if model_names is not None and (
+            not isinstance(model_names, list) or any(name not in MODEL_NAMES for name in model_names)):
+        return jsonify({'error': f"'models' must be a list drawn from {list(MODEL_NAMES)}"}), 400
+
+    model_names = model_names or get_model_status()['loaded_models']
+    reload_models_async(model_names)
+    return jsonify({
+        'status': 'reloading',
+        'models': model_names,
+        'current_versions': {name: get_model_version(name) for name in model_names}
+    }), 202
+
+# ✅ Analyzer calls shared by the single endpoints and /api/insights - each returns (result, status)
+def _diet_result(data):
+    return get_recommender('diet').get_diet_recommendations(data), 200
+
+def _stress_result(data):
+    stress = get_recommender('stress')
+    if data.get('incremental'):
+        # Trends come from the user's stored state plus the new check-in - daily_logs
+        # is only read the first time a user is seen
+        if _trend_store is None:
+            return {'error': 'Incremental mode is not enabled (set TREND_STORE_PATH)'}, 400
+        user_id = data.get('user_id')
+        if not user_id:
+            return {'error': "Invalid request: 'user_id' is required in incremental mode"}, 400
+        trends = stress.incremental_trends(
+            _trend_store, user_id, data.get('current_check_in'), data.get('daily_logs')
+        )
+        return stress.analyze_stress(data, trends=trends), 200
+    return stress.analyze_stress(data), 200
+
+def _workout_result(data):
+    return get_recommender('workout').get_workout_recommendations(data), 200
+
+_ANALYZERS = {
+    'diet': _diet_result,
+    'stress': _stress_result,
+    'workout': _workout_result
+}
+
 @app.route('/api/diet', methods=['POST'])
 @cache_response('diet')
 def diet_recommendations():
@@ -216,11 +515,9 @@ def diet_recommendations():
         if validation_error:
             return validation_error[0], validation_error[1]
 
-        data = request.json
-        recommendations = get_diet_recommendations(data)
-        return recommendations, 200
+        return _diet_result(request.json)
     except Exception as e:
-        logger.error(f"Diet API Error: {str(e)}", exc_info=env=='development')
+        logger.error("Diet API Error: %s", e, exc_info=env=='development')
         return {'error': str(e)}, 500
 
 @app.route('/api/stress', methods=['POST'])
@@ -231,11 +528,9 @@ def stress_analysis():
         if validation_error:
             return validation_error[0], validation_error[1]
 
-        data = request.json
-        analysis = analyze_stress(data)
-        return analysis, 200
+        return _stress_result(request.json)
     except Exception as e:
-        logger.error(f"Stress API Error: {str(e)}", exc_info=env=='development')
+        logger.error("Stress API Error: %s", e, exc_info=env=='development')
         return {'error': str(e)}, 500
 
 @app.route('/api/workout', methods=['POST'])
@@ -246,13 +541,105 @@ def workout_recommendations():
         if validation_error:
             return validation_error[0], validation_error[1]
 
-        data = request.json
-        recommendations = get_workout_recommendations(data)
-        return recommendations, 200
+        return _workout_result(request.json)
     except Exception as e:
-        logger.error(f"Workout API Error: {str(e)}", exc_info=env=='development')
+        logger.error("Workout API Error: %s", e, exc_info=env=='development')
         return {'error': str(e)}, 500
 
+# ✅ Combined dashboard endpoint - one round-trip instead of three
+# Threads running the analyzers of one /api/insights request side by side
+INSIGHTS_WORKERS = max(1, int(os.getenv('INSIGHTS_WORKERS', 3)))
+_insights_executor = None
+_insights_executor_lock = threading.Lock()
+
+def _get_insights_executor():
+    """Created on first use, so a gunicorn master that preloads the app never owns the threads"""
+    global _insights_executor
+    with _insights_executor_lock:
+        if _insights_executor is None:
+            _insights_executor = ThreadPoolExecutor(max_workers=INSIGHTS_WORKERS, thread_name_prefix='insights')
+        return _insights_executor
+
+def _insight_section(name, data):
+    """One analyzer's (result, status, cache_hit), with its errors kept inside the section"""
+    try:
+        return run_cached(name, data, lambda: _ANALYZERS[name](data))
+    except Exception as e:
+        logger.error("Insights %s error: %s", name, e, exc_info=env=='development')
+        return {'error': str(e)}, 500, False
+
+@app.route('/api/insights', methods=['POST'])
+def insights():
+    """
+    Diet, stress and workout analysis for one user in a single request. The body is the
+    union of the three endpoints' payloads, plus optional "sections" to run a subset.
+    Each section is cached under the same key as its own endpoint.
+    """
+    try:
+        validation_error = validate_request(request)
+        if validation_error:
+            return jsonify(validation_error[0]), validation_error[1]
+
+        data = request.json
+        sections = data.get('sections') or list(_ANALYZERS)
+        if not isinstance(sections, list) or not set(sections) <= set(_ANALYZERS):
+            return jsonify({'error': f"Invalid request: 'sections' must be a subset of {list(_ANALYZERS)}"}), 400
+
+        executor = _get_insights_executor()
+        futures = {name: executor.submit(_insight_section, name, data) for name in sections}
+        response = {'cache_hits': []}
+        for name, future in futures.items():
+            result, status_code, cache_hit = future.result()
+            response[name] = result
+            if status_code != 200:
+                response.setdefault('errors', {})[name] = status_code
+            if cache_hit:
+                response['cache_hits'].append(name)
+        return jsonify(response), 200
+    except Exception as e:
+        logger.error("Insights API Error: %s", e, exc_info=env=='development')
+        return jsonify({'error': str(e)}), 500
+
+# ✅ Batch endpoints - score a cohort of users with one model pass per request
+@app.route('/api/diet/batch', methods=['POST'])
+def diet_recommendations_batch():
+    try:
+        validation_error = validate_batch_request(request)
+        if validation_error:
+            return jsonify(validation_error[0]), validation_error[1]
+
+        results = get_recommender('diet').get_diet_recommendations_batch(request.json['users'])
+        return jsonify({'results': results, 'count': len(results)}), 200
+    except Exception as e:
+        logger.error("Diet batch API Error: %s", e, exc_info=env=='development')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stress/batch', methods=['POST'])
+def stress_analysis_batch():
+    try:
+        validation_error = validate_batch_request(request)
+        if validation_error:
+            return jsonify(validation_error[0]), validation_error[1]
+
+        results = get_recommender('stress').analyze_stress_batch(request.json['users'])
+        return jsonify({'results': results, 'count': len(results)}), 200
+    except Exception as e:
+        logger.error("Stress batch API Error: %s", e, exc_info=env=='development')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/workout/batch', methods=['POST'])
+def workout_recommendations_batch():
+    try:
+        validation_error = validate_batch_request(request)
+        if validation_error:
+            return jsonify(validation_error[0]), validation_error[1]
+
+        results = get_recommender('workout').get_workout_recommendations_batch(request.json['users'])
+        return jsonify({'results': results, 'count': len(results)}), 200
+    except Exception as e:
+        logger.error("Workout batch API Error: %s", e, exc_info=env=='development')
+        return jsonify({'error': str(e)}), 500
+
 # ✅ Pre-load all models on startup (configurable: sync, async, or lazy)
 def preload_models(async_mode=None):
     """
@@ -270,24 +657,31 @@ def preload_models(async_mode=None):
         async_mode = os.getenv('PRELOAD_ASYNC', 'true').lower() == 'true'
     
     models_to_load = ['diet', 'stress', 'workout']
+    # Models load concurrently - joblib/NumPy release the GIL for most of the file I/O
+    preload_workers = max(1, int(os.getenv('PRELOAD_WORKERS', len(models_to_load))))
+    
+    def _load_one(model_name):
+        try:
+            logger.info(f"Loading {model_name} model...")
+            model_start = time.time()
+            model = get_model(model_name)
+            if model:
+                # Published warm (first-call costs paid), so /api/ready only passes once predictions are fast
+                logger.info(f"✅ {model_name} model loaded successfully in {time.time() - model_start:.2f}s")
+                return True
+            logger.warning(f"⚠️ {model_name} model returned None, will use fallback")
+        except Exception as e:
+            logger.error(f"❌ Failed to load {model_name} model: {e}")
+        return False
     
     def _load_all():
         """Internal function to load all models"""
         logger.info("🚀 Pre-loading ML models...")
         start_time = time.time()
-        loaded = []
         
-        for model_name in models_to_load:
-            try:
-                logger.info(f"Loading {model_name} model...")
-                model = get_model(model_name)
-                if model:
-                    loaded.append(model_name)
-                    logger.info(f"✅ {model_name} model loaded successfully")
-                else:
-                    logger.warning(f"⚠️ {model_name} model returned None, will use fallback")
-            except Exception as e:
-                logger.error(f"❌ Failed to load {model_name} model: {e}")
+        with ThreadPoolExecutor(max_workers=preload_workers, thread_name_prefix='model_loader') as executor:
+            results = list(executor.map(_load_one, models_to_load))
+        loaded = [model_name for model_name, ok in zip(models_to_load, results) if ok]
         
         total_time = time.time() - start_time
         logger.info(f"✅ Model pre-loading complete: {len(loaded)}/{len(models_to_load)} models loaded in {total_time:.2f}s")
@@ -300,8 +694,7 @@ def preload_models(async_mode=None):
         loaded_models = []
         
         def _async_loader():
-            nonlocal loaded_models
-            loaded_models = _load_all()
+            loaded_models.extend(_load_all())
             loaded_event.set()
         
         thread = threading.Thread(target=_async_loader, daemon=True, name='model_preloader')
@@ -312,13 +705,50 @@ def preload_models(async_mode=None):
         # Synchronous loading - blocks until all models loaded
         return _load_all()
 
+# Handle returned by the startup preload - (event, loaded list) when async, else the loaded list
+_preload_handle = None
+_preload_lock = threading.Lock()
+
+def start_preload():
+    """Start the background preload once per process (called in each lazy gunicorn worker)"""
+    global _preload_handle
+    with _preload_lock:
+        if _preload_handle is None:
+            _preload_handle = preload_models(async_mode=True)
+
+# Set once the models have been loaded in the gunicorn master (SHARED_MODELS=true)
+_models_preloaded_in_master = False
+
+def preload_models_for_fork():
+    """
+    Load every model synchronously in the gunicorn master (preload_app=True) and freeze
+    the resulting objects, so forked workers share the model pages copy-on-write.
+    Called from gunicorn.conf.py's when_ready hook before any worker is forked.
+    """
+    global _models_preloaded_in_master, _preload_handle
+    loaded = _preload_handle = preload_models(async_mode=False)
+    # Move everything alive now into the permanent generation: the collector never
+    # visits these objects again, so it does not dirty their pages in the workers
+    gc.collect()
+    gc.freeze()
+    _models_preloaded_in_master = True
+    logger.info(f"🧊 {len(loaded)} models loaded in master, {gc.get_freeze_count()} objects frozen before fork")
+    return loaded
+
+# Import cost of the app itself - numpy, sklearn and the recommenders are deferred
+APP_IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
+logger.info(f"⚡ App imported in {APP_IMPORT_MS:.0f}ms (scientific stack deferred)")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     
     # OPTIMIZED: Async model loading prevents Render health check timeouts
     # Server starts immediately, models load in background thread
     # Set PRELOAD_ASYNC=false for synchronous loading (e.g., local development)
-    preload_result = preload_models(async_mode=None)  # Uses PRELOAD_ASYNC env var
+    if SHARED_MODELS:
+        restore_cache_snapshot()  # No gunicorn master here - restore in this process
+    preload_result = _preload_handle = preload_models(async_mode=None)  # Uses PRELOAD_ASYNC env var
+    start_reload_watcher()  # Polls for retrained models when MODEL_RELOAD_INTERVAL > 0
     
     logger.info(f"🚀 Starting Flask AI server on port {port} in {env} mode")
     if isinstance(preload_result, tuple):
@@ -326,4 +756,6 @@ if __name__ == '__main__':
     else:
         logger.info(f"📊 Models pre-loaded on startup: {len(preload_result)} models")
     logger.info(f"💾 Responses cached for {CACHE_TTL_MINUTES} minutes")
+    if CACHE_SNAPSHOT_PATH:
+        atexit.register(save_cache_snapshot)
     app.run(host='0.0.0.0', port=port, debug=env=='development')
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Cohort Trends - Nightly stress/sleep/mood trends for the whole user base in one pass
+
+    python cohort_trends.py users.jsonl -o trends.jsonl
+
+Input is a JSON array or JSON Lines of {"user_id": ..., "daily_logs": [...]} objects
+(daily_logs as /api/stress takes them, newest first), or an .npz of columnar arrays:
+  segmented: when (UTC microseconds or datetime64), values (3, n_logs), offsets (n_users + 1)
+  padded:    when (n_users, max_logs), values (3, n_users, max_logs), lengths (n_users)
+with an optional user_ids array. Writes one JSON line per user with the same stress,
+sleep and mood results as analyze_stress_pattern / analyze_sleep_pattern /
+analyze_mood_pattern.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from models.trend_engine import CohortColumns
+
+
+def read_users(path):
+    """(user_id, daily_logs) pairs from a JSON array or JSON Lines file ('-' for stdin)"""
+    stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    with stream:
+        text = stream.read()
+    stripped = text.lstrip()
+    records = json.loads(text) if stripped.startswith('[') else [
+        json.loads(line) for line in text.splitlines() if line.strip()
+    ]
+    return [(record.get('user_id'), record.get('daily_logs') or []) for record in records]
+
+
+def read_columns(path):
+    """CohortColumns from a segmented or padded .npz"""
+    with np.load(path, allow_pickle=False) as arrays:
+        user_ids = arrays['user_ids'].tolist() if 'user_ids' in arrays else None
+        if 'offsets' in arrays:
+            when = arrays['when']
+            if np.issubdtype(when.dtype, np.datetime64):
+                when = when.astype('datetime64[us]').astype(np.int64)
+            return CohortColumns(when, arrays['values'], arrays['offsets'], user_ids)
+        return CohortColumns.from_padded(arrays['when'], arrays['values'], arrays['lengths'], user_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute check-in trends for many users at once')
+    parser.add_argument('input', help="users .json/.jsonl ('-' for stdin) or columnar .npz")
+    parser.add_argument('-o', '--output', default='-', help="JSON Lines output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.input.endswith('.npz'):
+        columns = read_columns(args.input)
+    else:
+        columns = CohortColumns.from_users(read_users(args.input))
+    parsed = time.perf_counter()
+    results = columns.describe()
+    computed = time.perf_counter()
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        for result in results:
+            output.write(json.dumps(result) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"✅ Trends for {len(results)} users ({len(columns.when)} check-ins): "
+          f"load {(parsed - started) * 1000:.0f}ms, analyze {(computed - parsed) * 1000:.0f}ms",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,21 @@
 # gunicorn.conf.py - Optimized for Render Free Tier (512MB RAM)
 import os
+import sys
 import multiprocessing
 
 # Bind to the port Render provides
 bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
 
-# Worker configuration - Single worker for 512MB RAM limit
-workers = 1
-worker_class = "sync"
+# Shared-model production mode: the master loads all models before forking and the
+# workers share them copy-on-write, so several workers fit in 512MB
+SHARED_MODELS = os.environ.get('SHARED_MODELS', 'false').lower() == 'true'
+
+# Worker configuration - Single worker for 512MB RAM limit unless models are shared
+workers = int(os.environ.get('GUNICORN_WORKERS', '3' if SHARED_MODELS else '1'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+# Threads per worker (used by the gthread worker class). Pair with INFERENCE_BATCHING=true
+# so concurrent requests share one model pass instead of traversing the forest each.
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
 
 # Timeout settings - Increased for ML model loading
 # Render free tier needs more time to load scikit-learn models
@@ -19,8 +27,9 @@ keepalive = 2
 max_requests = 1000
 max_requests_jitter = 50
 
-# Preload app disabled for free tier - lazy load models on first request to save memory
-preload_app = False
+# Preload app disabled for free tier - each worker loads its models in the background once it starts.
+# SHARED_MODELS=true imports the app in the master so the models can be loaded there once.
+preload_app = SHARED_MODELS
 
 # Logging - Explicit configuration for Render logs
 accesslog = "-"  # Log to stdout
@@ -54,9 +63,29 @@ def on_reload(server):
 
 def when_ready(server):
     """Called just after the server is started."""
+    if SHARED_MODELS:
+        # Runs in the master before the first worker is forked
+        sys.modules['app'].preload_models_for_fork()
     print("✅ Gunicorn server is ready")
 
 
+def post_worker_init(worker):
+    """Called in the worker once the app is imported."""
+    app_module = sys.modules['app']
+    # The app starts without numpy/sklearn; import them in the background so the
+    # first request does not pay for it (PRELOAD_IMPORTS)
+    if not SHARED_MODELS:
+        app_module.warm_imports()
+        # Load and warm the models in the background so /api/ready can pass
+        app_module.start_preload()
+    else:
+        # The app was imported in the master, before any snapshot was written - load the
+        # entries saved by the workers that exited since (CACHE_SNAPSHOT_PATH)
+        app_module.restore_cache_snapshot()
+    # Pick up retrained models without a restart (MODEL_RELOAD_INTERVAL)
+    app_module.start_reload_watcher()
+
+
 def worker_int(worker):
     """Called when a worker receives SIGINT or SIGQUIT."""
     print(f"⚠️ Worker {worker.pid} interrupted")
@@ -67,6 +96,14 @@ def worker_abort(worker):
     print(f"🚨 Worker {worker.pid} aborted - likely due to timeout")
 
 
+def worker_exit(server, worker):
+    """Called in the worker just after it exits (including max_requests recycling)."""
+    # Snapshot the response cache so the replacement worker starts warm (needs CACHE_SNAPSHOT_PATH)
+    app_module = sys.modules.get('app')
+    if app_module is not None and hasattr(app_module, 'save_cache_snapshot'):
+        app_module.save_cache_snapshot()
+
+
 def on_exit(server):
     """Called just before exiting Gunicorn."""
     print("👋 Gunicorn shutting down...")
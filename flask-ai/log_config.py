@@ -0,0 +1,192 @@
+"""
+Log Config - Root logging setup for the Flask AI service
+In 'queue' mode (LOG_MODE) request threads only put records on an in-memory queue;
+a background QueueListener thread formats and writes them to stdout, so a slow or
+blocked stdout pipe never adds latency to a request. When the queue is full, records
+below WARNING are dropped and counted; warnings and errors wait briefly for a slot
+and are otherwise written directly, so they are never lost under overload.
+
+Records logged with extra={'payload': True} (whole request bodies, per-request
+profiles and ML probabilities) are sampled per logger (LOG_PAYLOAD_SAMPLING), so
+they can stay at INFO without every request paying to format and write them.
+"""
+import logging
+import os
+import queue
+import sys
+import threading
+from collections import defaultdict
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+
+# 'queue' hands records to a background writer thread; 'sync' writes in the request thread
+LOG_MODE = os.getenv('LOG_MODE', 'queue').lower()
+# Records buffered for the writer thread before new ones are dropped (payload records
+# are already formatted, so this bounds memory on the 512MB tier)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 1000))
+# Seconds a WARNING+ record waits for a free slot before it is written from the request thread
+LOG_QUEUE_TIMEOUT = float(os.getenv('LOG_QUEUE_TIMEOUT', 0.5))
+# Fraction of payload records kept: a default rate and/or logger=rate overrides, e.g.
+# "0.1,models.stress_analysis=0.01" (a logger name also matches its children)
+LOG_PAYLOAD_SAMPLING = os.getenv('LOG_PAYLOAD_SAMPLING', '1')
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_handler = None
+_listener = None
+_sampler = None
+_lock = threading.Lock()
+
+
+def parse_sampling(spec):
+    """(default rate, {logger name: rate}) from a LOG_PAYLOAD_SAMPLING value"""
+    default = 1.0
+    rates = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, rate = entry.rpartition('=')
+        rate = min(max(float(rate), 0.0), 1.0)
+        if name:
+            rates[name.strip()] = rate
+        else:
+            default = rate
+    return default, rates
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Keeps every Nth payload record per logger (N = 1 / rate); other records pass.
+    Counting instead of drawing random numbers keeps the kept share exact under load.
+    """
+    def __init__(self, default_rate=1.0, rates=None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = dict(rates or {})
+        self._every = {}
+        self._counters = defaultdict(count)
+        self.kept = 0
+        self.dropped = 0
+
+    def _rate(self, name):
+        # Most specific configured logger wins: 'models.stress_analysis' before 'models'
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return self.default_rate
+
+    def every(self, name):
+        every = self._every.get(name)
+        if every is None:
+            rate = self._rate(name)
+            every = self._every[name] = round(1 / rate) if rate > 0 else 0
+        return every
+
+    def filter(self, record):
+        if not getattr(record, 'payload', False):
+            return True
+        every = self.every(record.name)
+        if every and next(self._counters[record.name]) % every == 0:
+            self.kept += 1
+            return True
+        self.dropped += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler for a bounded queue. When it is full, INFO/DEBUG records are dropped
+    (and counted) instead of blocking; WARNING and above wait up to LOG_QUEUE_TIMEOUT
+    and then go straight to the fallback handler.
+    """
+    def __init__(self, log_queue, fallback):
+        super().__init__(log_queue)
+        self.fallback = fallback
+        self.dropped = 0
+        self.written_directly = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+                return
+        try:
+            self.queue.put(record, timeout=LOG_QUEUE_TIMEOUT)
+        except queue.Full:
+            # Already prepared (message and traceback formatted), so it writes as-is
+            self.fallback.handle(record)
+            self.written_directly += 1
+
+
+def _start_listener(stream_handler):
+    global _listener
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork():
+    """The writer thread doesn't survive fork() - give the child its own queue and thread"""
+    if _listener is not None:
+        _start_listener(_listener.handlers[0])
+
+
+def configure_logging(level):
+    """
+    Install the root handler once: stdout, directly ('sync') or via the queue ('queue'),
+    with payload sampling applied before any message is formatted.
+    """
+    global _handler, _sampler
+    with _lock:
+        if _handler is not None:
+            return _handler
+        stream_handler = logging.StreamHandler(sys.stdout)  # Ensure logs go to stdout for Render
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        _sampler = PayloadSampler(*parse_sampling(LOG_PAYLOAD_SAMPLING))
+
+        if LOG_MODE == 'queue':
+            _handler = DroppingQueueHandler(None, stream_handler)
+            _start_listener(stream_handler)
+            os.register_at_fork(after_in_child=_restart_after_fork)
+        else:
+            _handler = stream_handler
+        _handler.addFilter(_sampler)
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_handler)
+        return _handler
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread (registered with atexit)"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        # Anything logged after this point is written directly
+        stream_handler = listener.handlers[0]
+        stream_handler.addFilter(_sampler)
+        logging.getLogger().removeHandler(_handler)
+        logging.getLogger().addHandler(stream_handler)
+
+
+def get_logging_stats():
+    return {
+        'mode': 'queue' if isinstance(_handler, QueueHandler) else 'sync',
+        'queued': _handler.queue.qsize() if isinstance(_handler, QueueHandler) else 0,
+        'queue_size': LOG_QUEUE_SIZE if isinstance(_handler, QueueHandler) else None,
+        'dropped_queue_full': getattr(_handler, 'dropped', 0),
+        'written_directly': getattr(_handler, 'written_directly', 0),
+        'payload_sampling': {
+            'default_rate': _sampler.default_rate if _sampler else 1.0,
+            'rates': _sampler.rates if _sampler else {},
+            'kept': _sampler.kept if _sampler else 0,
+            'dropped': _sampler.dropped if _sampler else 0
+        }
+    }
@@ -1,9 +1,16 @@
-import numpy as np
-from datetime import datetime
 import os
 import logging
-import joblib
-import pandas as pd
+
+from models.model_manager import (
+    LoadedModel, ML_NOT_COMPUTED, model_file_version, predict_record, predict_records, publish_model,
+    published_model
+)
+from models.forest_engine import load_engine
+from models.feature_spec import FeatureSpec, Numeric
+from models.prediction_memo import QuantizedMemo, parse_steps
+from models.meal_timing import MealTiming, clock_time
+from models.profile import get_profile
+from models.metrics import excluded_from_rules, rule_engine_timer
 
 # Create a logger
 logger = logging.getLogger(__name__)
@@ -12,29 +19,51 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, 'diet_model.pkl')
 
-# Load model at module level - LAZY LOADING: model is NOT loaded at import time
-_model_data = None
-_model = None
-_feature_names = None
-_model_loaded = False
+# Model inputs, in the order records are passed to the compiled spec
+DIET_FEATURES = FeatureSpec(
+    Numeric('calories'),
+    Numeric('protein'),
+    Numeric('carbohydrates'),
+    Numeric('fats')
+)
 
-def load_model():
-    """Load the trained diet model - Returns model data dict or None"""
-    global _model_data, _model, _feature_names, _model_loaded
-    
+# Synthetic intakes scored by model_manager.publish_model() before the model takes traffic
+# (calories, protein, carbohydrates, fats)
+WARMUP_RECORDS = [
+    (2000, 80, 250, 70),
+    (1600, 60, 180, 50),
+    (2800, 140, 320, 95),
+    (2200, 100, 150, 110)
+]
+
+# Nearby intakes get the same prediction - 25 kcal / 5 g buckets by default
+# (calories, protein, carbohydrates, fats)
+_prediction_memo = QuantizedMemo(parse_steps('DIET_MEMO_STEPS', (25, 5, 5, 5)))
+
+def load_model(engine=None, reload=False):
+    """
+    Load the trained diet model - Returns model data dict or None
+    engine: 'auto', 'sklearn' or 'compiled' (defaults to the INFERENCE_ENGINE env var)
+    reload: load a fresh copy from disk, warm it and swap it in (the old model serves until then)
+    """
     # Return already loaded model data
-    if _model_loaded and _model_data is not None:
-        return _model_data
+    published = published_model('diet')
+    if published is not None and not reload:
+        return published.info
     
     try:
         if os.path.exists(MODEL_PATH):
             logger.info(f"🔄 Loading diet model from {MODEL_PATH}...")
-            _model_data = joblib.load(MODEL_PATH)
-            _model = _model_data["pipeline"]
-            _feature_names = _model_data["feature_names"]
-            _model_loaded = True
-            logger.info(f"✅ Diet model loaded successfully")
-            return _model_data
+            version = model_file_version(MODEL_PATH)
+            model, feature_names = load_engine(MODEL_PATH, engine, version)
+            feature_spec = DIET_FEATURES.compile(feature_names)
+            info = {"feature_names": feature_names, "engine": model.name, "version": version}
+            loaded = LoadedModel(model, feature_names, feature_spec, info)
+            # Warmed before it takes traffic; on reload, requests in flight keep the old model
+            publish_model('diet', loaded, WARMUP_RECORDS)
+            _prediction_memo.clear()
+            logger.info(f"✅ Diet model loaded successfully ({model.name} engine, version {version})")
+            return info
         else:
             logger.warning(f"Diet model not found at {MODEL_PATH}, using rule-based fallback")
             return None
@@ -46,83 +75,106 @@ def load_model():
 # Models are now loaded lazily via model_manager.py on first request
 # load_model()  # <-- This was causing timeout issues on Render
 
-def calculate_age(date_of_birth):
-    """Calculate age from date of birth"""
-    if not date_of_birth:
-        logger.warning("No date of birth provided")
-        return None
-    today = datetime.now()
+@excluded_from_rules
+def get_ml_recommendation(calories, protein, carbs, fats):
+    """Get recommendation from ML model"""
     try:
-        # Try parsing different date formats
-        for date_format in ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ']:
-            try:
-                born = datetime.strptime(date_of_birth, date_format)
-                age = today.year - born.year
-                if today.month < born.month or (today.month == born.month and today.day < born.day):
-                    age -= 1
-                logger.info(f"Successfully calculated age: {age} from date: {date_of_birth}")
-                return age
-            except ValueError:
-                continue
-        
-        logger.error(f"Failed to parse date of birth: {date_of_birth}")
-        return None
-    except (TypeError, Exception) as e:
-        logger.error(f"Error calculating age: {str(e)}")
+        return predict_record('diet', (calories, protein, carbs, fats), get_ml_recommendations_batch, memo=_prediction_memo, log=logger)
+    except Exception as e:
+        logger.error("Error getting ML recommendation: %s", e)
         return None
 
-def get_ml_recommendation(calories, protein, carbs, fats):
-    """Get recommendation from ML model"""
+def get_prediction_memo_stats():
+    """Hit/miss statistics of the quantized prediction memo"""
+    return _prediction_memo.stats()
+
+def get_ml_recommendations_batch(intakes):
+    """
+    Get recommendations for many intakes with a single predict_proba call.
+    intakes: list of (calories, protein, carbs, fats) tuples
+    Returns a list of ML result dicts (all None if the model is unavailable).
+    """
     try:
-        if _model is None:
-            return None
-        
-        # Create feature vector
-        features = pd.DataFrame([[calories, protein, carbs, fats]], 
-                                columns=['calories', 'protein', 'carbohydrates', 'fats'])
-        
-        # Ensure correct feature order
-        features = features[_feature_names]
-        
-        # Get prediction
-        prediction = _model.predict(features)[0]
-        probabilities = _model.predict_proba(features)[0]
-        
-        logger.info(f"ML prediction: {prediction}, probabilities: {probabilities}")
-        return {
-            'category': prediction,
-            'confidence': float(max(probabilities)),
-            'all_probabilities': dict(zip(_model.classes_, probabilities))
-        }
+        return predict_records('diet', intakes, log=logger)
     except Exception as e:
-        logger.error(f"Error getting ML recommendation: {e}")
+        logger.error("Error getting batch ML recommendations: %s", e)
+        return [None] * len(intakes)
+
+def _current_intake(data):
+    """Extract (calories, protein, carbs, fats) from a request payload"""
+    daily_intake = data.get('daily_intake', {})
+    macronutrients = daily_intake.get('macronutrients', {})
+    return (
+        daily_intake.get('calories', 0),
+        macronutrients.get('protein', 0),
+        macronutrients.get('carbohydrates', 0),
+        macronutrients.get('fats', 0)
+    )
+
+def get_diet_recommendations_batch(payloads):
+    """
+    Generate diet recommendations for many users at once.
+    All intakes are scored in one model pass, then the rule logic runs per user.
+    """
+    intakes = []
+    scored = []
+    for index, data in enumerate(payloads):
+        try:
+            intakes.append(tuple(float(value) for value in _current_intake(data)))
+            scored.append(index)
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning("Skipping ML scoring for batch item %d: %s", index, e)
+
+    ml_results = [None] * len(payloads)
+    for index, ml_result in zip(scored, get_ml_recommendations_batch(intakes)):
+        ml_results[index] = ml_result
+
+    return [
+        get_diet_recommendations(data, ml_result=ml_result)
+        for data, ml_result in zip(payloads, ml_results)
+    ]
+
+def _meal_timing_fields(summary):
+    """MealTimingSummary as response fields (None when no meal timestamps parsed)"""
+    if summary is None:
         return None
 
-def get_diet_recommendations(data):
+    def rounded(value, digits=1):
+        return None if value is None else round(value, digits)
+
+    return {
+        'days_logged': summary.days_logged,
+        'meals_per_day': rounded(summary.meals_per_day),
+        'avg_gap_hours': rounded(summary.avg_gap_hours),
+        'max_gap_hours': rounded(summary.max_gap_hours),
+        'first_meal': clock_time(summary.first_meal),
+        'last_meal': clock_time(summary.last_meal),
+        'first_meal_variation_minutes': rounded(summary.first_meal_variation_minutes, 0),
+        'last_meal_variation_minutes': rounded(summary.last_meal_variation_minutes, 0)
+    }
+
+@rule_engine_timer('diet')
+def get_diet_recommendations(data, ml_result=ML_NOT_COMPUTED):
     """
     Generate personalized diet recommendations based on available user data and nutrition logs.
     Uses ML model if available, falls back to rule-based logic.
+    ml_result can be passed in when the prediction was already computed in a batch.
     """
     try:
         user_data = data.get('user_data', {})
-        daily_intake = data.get('daily_intake', {})
         nutrition_logs = data.get('nutrition_logs', [])
 
-        # Get user profile data
-        date_of_birth = user_data.get('dateOfBirth')
-        logger.info(f"Retrieved date of birth: {date_of_birth}")
-        gender = user_data.get('gender', 'other')
-        age = calculate_age(date_of_birth)
-        logger.info(f"Calculated age: {age}")
+        # Get user profile data - parsed once per (dateOfBirth, gender) per day
+        profile = get_profile(user_data)
+        gender = profile.gender
+        age = profile.age
 
         # Get current intake
-        current_calories = daily_intake.get('calories', 0)
-        current_protein = daily_intake.get('macronutrients', {}).get('protein', 0)
-        current_carbs = daily_intake.get('macronutrients', {}).get('carbohydrates', 0)
-        current_fats = daily_intake.get('macronutrients', {}).get('fats', 0)
+        current_calories, current_protein, current_carbs, current_fats = _current_intake(data)
 
         # Try to get ML-based recommendation
-        ml_result = get_ml_recommendation(current_calories, current_protein, current_carbs, current_fats)
+        if ml_result is ML_NOT_COMPUTED:
+            ml_result = get_ml_recommendation(current_calories, current_protein, current_carbs, current_fats)
         
         recommendations = []
         meal_pattern = "Regular"
@@ -149,21 +201,13 @@ def get_diet_recommendations(data):
             elif 'Balanced' in ml_result['category']:
                 recommendations.append("Great job maintaining balanced nutrition!")
 
-        # Analyze meal timing patterns
-        meal_times = []
-        for log in nutrition_logs:
-            if 'timestamp' in log:
-                try:
-                    meal_time = datetime.fromisoformat(log['timestamp'].replace('Z', '+00:00'))
-                    meal_times.append(meal_time)
-                except (ValueError, AttributeError):
-                    continue
+        # Analyze meal timing patterns - timestamps parsed once and bucketed by local day
+        meal_timing = MealTiming.from_logs(nutrition_logs, data.get('utc_offset_minutes')).summary()
 
         # Gender and age-specific base calorie and nutrient recommendations
-        base_calories = None
+        base_calories = profile.base_calories
         if age and gender != 'other':
             if gender == 'female':
-                base_calories = 2000 if age < 50 else 1800
                 if not ml_result:  # Only add these if no ML result
                     recommendations.extend([
                         "Female-specific nutrition tips:",
@@ -172,7 +216,6 @@ def get_diet_recommendations(data):
                         "- Consider folate-rich foods for reproductive health"
                     ])
             elif gender == 'male':
-                base_calories = 2500 if age < 50 else 2200
                 if not ml_result:
                     recommendations.extend([
                         "Male-specific nutrition tips:",
@@ -181,17 +224,11 @@ def get_diet_recommendations(data):
                         "- Consider heart-healthy fats"
                     ])
 
-        # Analyze meal spacing
-        if meal_times:
-            meal_times.sort()
-            time_diffs = []
-            for i in range(1, len(meal_times)):
-                diff = (meal_times[i] - meal_times[i-1]).total_seconds() / 3600
-                time_diffs.append(diff)
-
-            if time_diffs:
-                avg_time_between_meals = sum(time_diffs) / len(time_diffs)
-                max_time_between_meals = max(time_diffs)
+        # Analyze meal spacing - only gaps between meals of the same day count
+        if meal_timing:
+            if meal_timing.avg_gap_hours is not None:
+                avg_time_between_meals = meal_timing.avg_gap_hours
+                max_time_between_meals = meal_timing.max_gap_hours
 
                 if max_time_between_meals > 6:
                     recommendations.append("Try to avoid gaps of more than 6 hours between meals")
@@ -204,6 +241,10 @@ def get_diet_recommendations(data):
                     recommendations.append("Consider adding healthy snacks between meals")
                     meal_pattern = "Infrequent"
 
+            # Regularity across recent weeks: when the day's first meal happens
+            if meal_timing.days_logged >= 7 and (meal_timing.first_meal_variation_minutes or 0) > 90:
+                recommendations.append("Try to have your first meal at a similar time each day")
+
         # Basic nutrient balance recommendations (only if no ML result)
         if current_calories > 0 and not ml_result:
             protein_ratio = (current_protein * 4 / current_calories) if current_calories > 0 else 0
@@ -234,22 +275,22 @@ def get_diet_recommendations(data):
                 recommendations.append("Consider reducing fat intake, especially from processed foods")
 
         # Age-specific recommendations (keep these regardless)
-        if age is not None:
-            if age < 25:
+        if profile.age_group is not None:
+            if profile.age_group == 'young_adult':
                 recommendations.extend([
                     "Young adult nutrition tips:",
                     "- Support your active lifestyle with adequate calories",
                     "- Include foods rich in calcium and vitamin D",
                     "- Stay well-hydrated, especially during exercise"
                 ])
-            elif age >= 25 and age < 40:
+            elif profile.age_group == 'adult':
                 recommendations.extend([
                     "Adult nutrition tips:",
                     "- Balance nutrients for sustained energy",
                     "- Include anti-inflammatory foods",
                     "- Consider meal prep for consistent nutrition"
                 ])
-            elif age >= 40:
+            elif profile.age_group == 'mid_life':
                 recommendations.extend([
                     "Mid-life nutrition tips:",
                     "- Focus on nutrient-dense, whole foods",
@@ -278,6 +319,7 @@ def get_diet_recommendations(data):
                     }
                 },
                 'meal_pattern': meal_pattern,
+                'meal_timing': _meal_timing_fields(meal_timing),
                 'nutrient_balance': {
                     'protein_ratio': round(protein_ratio * 100) if current_calories > 0 else 0,
                     'carbs_ratio': round(carbs_ratio * 100) if current_calories > 0 else 0,
@@ -294,7 +336,7 @@ def get_diet_recommendations(data):
         }
 
     except Exception as e:
-        logger.error(f"Diet recommendation error: {e}")
+        logger.error("Diet recommendation error: %s", e)
         return {
             'recommendations': [
                 "Please complete your profile for personalized recommendations.",
@@ -0,0 +1,90 @@
+"""
+Feature Spec - Declarative description of each model's inputs
+A spec lists the numeric fields and one-hot groups a model consumes. It is compiled
+once against the feature_names saved with the model into a column index map, which
+then fills NumPy rows directly (no per-request dicts or DataFrames).
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# A numeric input copied into the column of the same name
+Numeric = namedtuple('Numeric', ['name'])
+
+# A categorical input expanded into '<prefix>_<category>' indicator columns
+OneHot = namedtuple('OneHot', ['prefix', 'categories'])
+
+
+class FeatureSpec:
+    """
+    Ordered list of model inputs. Records passed to the compiled spec are tuples
+    holding one value per field, in the order the fields are declared here.
+    """
+    def __init__(self, *fields):
+        self.fields = tuple(fields)
+
+    def compile(self, feature_names):
+        """Resolve every field to its column in feature_names"""
+        columns = {name: index for index, name in enumerate(feature_names)}
+        covered = set()
+        plan = []
+
+        for field in self.fields:
+            if isinstance(field, Numeric):
+                if field.name not in columns:
+                    raise ValueError(f"Model has no feature named '{field.name}'")
+                plan.append((True, columns[field.name]))
+                covered.add(field.name)
+            else:
+                # Categories the model was not trained on simply have no column
+                lookup = {}
+                for category in field.categories:
+                    column_name = f'{field.prefix}_{category}'
+                    if column_name in columns:
+                        lookup[category] = columns[column_name]
+                        covered.add(column_name)
+                plan.append((False, lookup))
+
+        missing = [name for name in feature_names if name not in covered]
+        if missing:
+            raise ValueError(f"Feature spec does not cover model features: {missing}")
+
+        return CompiledFeatureSpec(len(feature_names), plan)
+
+
+class CompiledFeatureSpec:
+    """Index map from record fields to matrix columns"""
+    def __init__(self, n_features, plan):
+        self.n_features = n_features
+        self._plan = tuple(plan)
+        self._local = threading.local()
+
+    def _fill(self, row, record):
+        for (is_numeric, target), value in zip(self._plan, record):
+            if is_numeric:
+                row[target] = float(value)
+            else:
+                column = target.get(value)
+                if column is not None:
+                    row[column] = 1.0
+
+    def row(self, record):
+        """
+        Fill this thread's preallocated (1, n_features) row and return it.
+        The array is reused by the next call on the same thread.
+        """
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=np.float64)
+        else:
+            row.fill(0.0)
+        self._fill(row[0], record)
+        return row
+
+    def matrix(self, records):
+        """Build an (n_records, n_features) matrix from a list of records"""
+        matrix = np.zeros((len(records), self.n_features), dtype=np.float64)
+        for row, record in zip(matrix, records):
+            self._fill(row, record)
+        return matrix
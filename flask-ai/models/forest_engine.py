@@ -0,0 +1,336 @@
+"""
+Forest Engine - Array-backed inference for the saved RandomForest pipelines
+Flattens every tree of the classifier into NumPy arrays and folds the StandardScaler
+into the split thresholds, so a batch of rows is scored without sklearn or pandas
+on the hot path.
+"""
+import os
+import json
+import shutil
+import logging
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inference engine used by load_model(): 'sklearn' (pipeline as saved), 'compiled', or
+# 'auto' - the compiled engine when a matching memory-mappable artifact exists, else sklearn
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'auto').lower()
+ENGINES = ('auto', 'sklearn', 'compiled')
+
+# Memory-mappable artifact written next to each .pkl by retrain_models.py
+ARTIFACT_FORMAT = 'compiled-forest'
+ARTIFACT_VERSION = 1
+ARTIFACT_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+
+
+class SklearnEngine:
+    """
+    Runs the saved sklearn pipeline on NumPy rows already ordered like feature_names.
+    The pipeline was fitted on a DataFrame, so the stored column names are dropped
+    once here (after checking they match) instead of building a DataFrame per request.
+    """
+    name = 'sklearn'
+
+    def __init__(self, pipeline, feature_names):
+        fitted_names = getattr(pipeline, 'feature_names_in_', None)
+        if fitted_names is not None and list(fitted_names) != list(feature_names):
+            raise ValueError("Pipeline feature order does not match saved feature_names")
+        for _, step in pipeline.steps:
+            if hasattr(step, 'feature_names_in_'):
+                del step.feature_names_in_
+        self.pipeline = pipeline
+        self.classes_ = pipeline.classes_
+
+    def predict_proba(self, X):
+        return self.pipeline.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class CompiledForest:
+    """
+    RandomForestClassifier flattened into contiguous node arrays.
+    All trees share one node table; leaves point to themselves so every row can
+    take exactly max_depth vectorized steps regardless of where it lands.
+    """
+    name = 'compiled'
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Compile a Pipeline([('scaler', StandardScaler), ('classifier', RandomForestClassifier)])"""
+        scaler = pipeline.named_steps.get('scaler')
+        forest = pipeline.named_steps['classifier']
+        n_features = forest.n_features_in_
+
+        # x_scaled <= t  <=>  x <= t * scale + mean  (scale is always positive)
+        mean = getattr(scaler, 'mean_', None) if scaler is not None else None
+        scale = getattr(scaler, 'scale_', None) if scaler is not None else None
+        mean = np.zeros(n_features) if mean is None else np.asarray(mean, dtype=np.float64)
+        scale = np.ones(n_features) if scale is None else np.asarray(scale, dtype=np.float64)
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes)
+            is_leaf = tree.children_left == -1
+
+            feature = np.where(is_leaf, 0, tree.feature).astype(np.int32)
+            threshold = np.where(
+                is_leaf, np.inf, tree.threshold * scale[feature] + mean[feature]
+            )
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+
+            # Per-tree class distributions, normalized like DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :].astype(np.float64)
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0] = 1.0
+            value = value / totals
+
+            features.append(feature)
+            thresholds.append(threshold)
+            lefts.append(left.astype(np.int32))
+            rights.append(right.astype(np.int32))
+            values.append(value)
+            roots.append(offset)
+            offset += n_nodes
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            classes=np.asarray(forest.classes_),
+            max_depth=max_depth
+        )
+
+    def save(self, directory, feature_names, source_version=None):
+        """
+        Write the node arrays as uncompressed .npy files plus a manifest.json, so
+        load() can memory-map them and workers share the pages through the page cache.
+        The directory is swapped into place only once fully written. source_version is
+        the version of the .pkl it was compiled from (see load_engine).
+        """
+        tmp_dir = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for array_name in ARTIFACT_ARRAYS:
+            np.save(os.path.join(tmp_dir, f'{array_name}.npy'), np.ascontiguousarray(getattr(self, array_name)))
+        manifest = {
+            'format': ARTIFACT_FORMAT,
+            'version': ARTIFACT_VERSION,
+            'source_version': source_version,
+            'feature_names': list(feature_names),
+            'classes': [str(c) for c in self.classes_],
+            'max_depth': self.max_depth,
+            'n_trees': int(self.roots.shape[0]),
+            'n_nodes': int(self.feature.shape[0]),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        old_dir = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open an artifact written by save(); returns (engine, feature_names, source_version)"""
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != ARTIFACT_FORMAT or manifest.get('version') != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported model artifact in {directory}")
+        # Plain ndarray views over the mapping - np.memmap's subclass hooks slow down fancy indexing
+        arrays = {
+            array_name: np.load(os.path.join(directory, f'{array_name}.npy'), mmap_mode=mmap_mode).view(np.ndarray)
+            for array_name in ARTIFACT_ARRAYS
+        }
+        engine = cls(classes=np.asarray(manifest['classes']), max_depth=manifest['max_depth'], **arrays)
+        return engine, manifest['feature_names'], manifest.get('source_version')
+
+    def apply(self, X):
+        """Return the leaf node index reached in every tree, shape (n_rows, n_trees)"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.roots.shape[0]))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X):
+        return self.value[self.apply(X)].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+class GridLookupEngine:
+    """
+    Dense table of precomputed probabilities for models with a small input space:
+    one one-hot group plus a few bounded numeric features. Inputs snap to the
+    nearest grid point, so scoring is a single fancy-index instead of a forest walk.
+    """
+    name = 'table'
+
+    def __init__(self, table, classes, one_hot_columns, numeric_columns, lows, steps):
+        self.table = table
+        self.classes_ = classes
+        self.one_hot_columns = np.asarray(one_hot_columns, dtype=np.intp)
+        self.numeric_columns = np.asarray(numeric_columns, dtype=np.intp)
+        self.lows = np.asarray(lows, dtype=np.float64)
+        self.steps = np.asarray(steps, dtype=np.float64)
+        self.sizes = np.asarray(table.shape[1:-1], dtype=np.intp)
+
+    @classmethod
+    def build(cls, engine, n_features, one_hot_columns, numeric_ranges, resolution, chunk_size=4096):
+        """
+        Evaluate engine over every grid point.
+        numeric_ranges: list of (column, low, high); grid spacing is resolution.
+        The category axis has one extra slot for rows where no one-hot column is set.
+        """
+        lows, steps, axes = [], [], []
+        for _, low, high in numeric_ranges:
+            points = int(round((high - low) / resolution)) + 1
+            lows.append(low)
+            steps.append((high - low) / (points - 1) if points > 1 else 1.0)
+            axes.append(np.linspace(low, high, points))
+
+        n_categories = len(one_hot_columns) + 1
+        grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+        X = np.zeros((n_categories * grid.shape[0], n_features), dtype=np.float64)
+        for category in range(n_categories):
+            block = X[category * grid.shape[0]:(category + 1) * grid.shape[0]]
+            if category < len(one_hot_columns):
+                block[:, one_hot_columns[category]] = 1.0
+            for axis, (column, _, _) in enumerate(numeric_ranges):
+                block[:, column] = grid[:, axis]
+
+        probabilities = np.concatenate([
+            engine.predict_proba(X[start:start + chunk_size])
+            for start in range(0, X.shape[0], chunk_size)
+        ])
+        shape = (n_categories, *(len(axis) for axis in axes), probabilities.shape[1])
+        return cls(
+            table=probabilities.reshape(shape),
+            classes=np.asarray(engine.classes_),
+            one_hot_columns=one_hot_columns,
+            numeric_columns=[column for column, _, _ in numeric_ranges],
+            lows=lows,
+            steps=steps
+        )
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        one_hot = X[:, self.one_hot_columns]
+        category = np.where(one_hot.max(axis=1) > 0, one_hot.argmax(axis=1), len(self.one_hot_columns))
+        positions = np.rint((X[:, self.numeric_columns] - self.lows) / self.steps).astype(np.intp)
+        positions = np.clip(positions, 0, self.sizes - 1)
+        return self.table[(category, *positions.T)]
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def artifact_path(model_path):
+    """Location of the memory-mappable artifact for a .pkl model path"""
+    return os.path.splitext(model_path)[0] + '.forest'
+
+
+def resolve_engine(engine=None):
+    """Normalize an engine name, defaulting to INFERENCE_ENGINE"""
+    engine = (engine or INFERENCE_ENGINE).lower()
+    if engine not in ENGINES:
+        logger.warning(f"Unknown inference engine '{engine}', using auto")
+        engine = 'auto'
+    return engine
+
+
+def export_artifact(pipeline, feature_names, model_path, source_version=None):
+    """Compile the pipeline and write its memory-mappable artifact next to model_path"""
+    directory = artifact_path(model_path)
+    CompiledForest.from_pipeline(pipeline).save(directory, feature_names, source_version)
+    return directory
+
+
+def build_engine(pipeline, feature_names, engine=None):
+    """Wrap a loaded pipeline in the requested inference engine ('auto' keeps sklearn)"""
+    engine = resolve_engine(engine)
+    if engine == 'compiled':
+        return CompiledForest.from_pipeline(pipeline)
+    return SklearnEngine(pipeline, feature_names)
+
+
+def load_engine(model_path, engine=None, version=None):
+    """
+    Load the model saved at model_path into the requested engine; returns (engine, feature_names).
+    The compiled and auto engines memory-map the exported artifact when it was compiled from
+    this version of the .pkl, which skips unpickling the sklearn forest altogether. Without
+    one, auto unpickles the .pkl into the sklearn engine.
+    """
+    engine = resolve_engine(engine)
+    directory = artifact_path(model_path)
+    if engine != 'sklearn' and os.path.exists(os.path.join(directory, 'manifest.json')):
+        try:
+            compiled, feature_names, source_version = CompiledForest.load(directory)
+            if version is None or source_version == version:
+                return compiled, feature_names
+            logger.warning(f"Model artifact {directory} was built from another version of {model_path}, ignoring it")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not open model artifact {directory}: {e}")
+
+    import joblib  # Only needed for .pkl models; mmap-loaded artifacts skip it
+    model_data = joblib.load(model_path)
+    feature_names = model_data["feature_names"]
+    return build_engine(model_data["pipeline"], feature_names, engine), feature_names
+
+
+def check_parity(pipeline, X, atol=1e-9):
+    """
+    Compare the compiled engine against sklearn on the same rows.
+    Returns a summary dict; 'ok' is False if any prediction differs or
+    probabilities drift beyond atol on more than a handful of boundary rows.
+    """
+    expected = pipeline.predict_proba(X)
+    X = np.asarray(X, dtype=np.float64)
+    compiled = CompiledForest.from_pipeline(pipeline)
+    actual = compiled.predict_proba(X)
+
+    expected_labels = pipeline.classes_[np.argmax(expected, axis=1)]
+    actual_labels = compiled.classes_[np.argmax(actual, axis=1)]
+    label_mismatches = int(np.sum(expected_labels != actual_labels))
+    drifted_rows = int(np.sum(np.any(np.abs(expected - actual) > atol, axis=1)))
+
+    return {
+        'rows': int(X.shape[0]),
+        'label_mismatches': label_mismatches,
+        'proba_drifted_rows': drifted_rows,
+        'max_abs_diff': float(np.max(np.abs(expected - actual))) if X.shape[0] else 0.0,
+        # Folding the scaler can move a value sitting exactly on a split threshold
+        'ok': label_mismatches == 0 and drifted_rows <= max(1, X.shape[0] // 10000)
+    }
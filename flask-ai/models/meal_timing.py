@@ -0,0 +1,115 @@
+"""
+Meal Timing - Vectorized meal-spacing analysis of nutrition_logs
+Timestamps are parsed once into a sorted datetime64 array of local meal times and
+bucketed by local day. Gaps are only measured between meals on the same day, so the
+overnight fast no longer counts as a "gap between meals". Per-day first/last meal
+times and gaps, and their regularity across recent weeks, are NumPy reductions.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import repeat
+
+import numpy as np
+
+# Days (ending at the latest logged day) over which meal-time regularity is measured
+REGULARITY_DAYS = 28
+
+_MINUTE = np.timedelta64(1, 'm')
+_MINUTES_PER_DAY = 24 * 60
+
+MealTimingSummary = namedtuple('MealTimingSummary', [
+    'days_logged', 'meals_per_day', 'avg_gap_hours', 'max_gap_hours',
+    'first_meal', 'last_meal', 'first_meal_variation_minutes', 'last_meal_variation_minutes'
+])
+
+
+def _parse_one(value, utc_offset):
+    """One timestamp as local datetime64[m]; aware times use utc_offset or their own offset"""
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        offset = moment.utcoffset() if utc_offset is None else utc_offset
+        moment = moment.replace(tzinfo=None) - moment.utcoffset() + offset
+    return np.datetime64(moment, 'm')
+
+
+def parse_meal_times(logs, utc_offset_minutes=None):
+    """
+    Local meal times of nutrition_logs as a sorted datetime64[m] array. Naive timestamps
+    are taken as local already. Timestamps with an offset ('Z' included) are shifted to
+    utc_offset_minutes (minutes east of UTC) when the client sends it, otherwise they
+    keep the offset they were written with. Unparseable timestamps are skipped.
+    """
+    try:
+        utc_offset_minutes = None if utc_offset_minutes is None else int(utc_offset_minutes)
+    except (TypeError, ValueError):
+        utc_offset_minutes = None  # A malformed offset is ignored, like a malformed timestamp
+    utc_offset = None if utc_offset_minutes is None else timedelta(minutes=utc_offset_minutes)
+    raw = [log.get('timestamp') for log in logs or [] if isinstance(log, dict)]
+
+    # Fast path: JavaScript toISOString() UTC timestamps, parsed by NumPy in one call
+    try:
+        if raw and all(map(str.endswith, raw, repeat('Z'))):
+            parsed = np.array(list(map(str.rstrip, raw, repeat('Z'))), dtype='datetime64[m]')
+            return np.sort(parsed + np.timedelta64(utc_offset_minutes or 0, 'm'))
+    except (TypeError, ValueError):
+        pass  # Not all strings, or something NumPy won't parse - fall back to one at a time
+
+    times = [_parse_one(value, utc_offset) for value in raw]
+    return np.sort(np.array([time for time in times if time is not None], dtype='datetime64[m]'))
+
+
+class MealTiming:
+    """Meals bucketed by local day. times: sorted datetime64[m] local meal times"""
+    def __init__(self, times):
+        self.times = times
+        days = times.astype('datetime64[D]')
+        same_day = days[1:] == days[:-1]
+        # First index of every logged day (times are sorted, so each day is one run)
+        self.day_starts = np.flatnonzero(np.r_[len(times) > 0, ~same_day])
+        self.days = days[self.day_starts]
+        # Gaps between consecutive meals of the same day, in hours
+        self.gaps = ((times[1:] - times[:-1]) / _MINUTE / 60.0)[same_day]
+        self.minute_of_day = (times - days) / _MINUTE
+
+    @classmethod
+    def from_logs(cls, logs, utc_offset_minutes=None):
+        return cls(parse_meal_times(logs, utc_offset_minutes))
+
+    def __len__(self):
+        return len(self.times)
+
+    def per_day(self):
+        """(meals, first meal minute, last meal minute) arrays with one entry per logged day"""
+        ends = np.r_[self.day_starts[1:], len(self.times)]
+        return (
+            ends - self.day_starts,
+            self.minute_of_day[self.day_starts],
+            self.minute_of_day[ends - 1]
+        )
+
+    def summary(self, regularity_days=REGULARITY_DAYS):
+        """MealTimingSummary, or None when nothing could be parsed"""
+        if not len(self.times):
+            return None
+        meals, first, last = self.per_day()
+        recent = self.days > self.days[-1] - np.timedelta64(regularity_days, 'D')
+        return MealTimingSummary(
+            days_logged=len(self.days),
+            meals_per_day=float(meals.mean()),
+            avg_gap_hours=float(self.gaps.mean()) if len(self.gaps) else None,
+            max_gap_hours=float(self.gaps.max()) if len(self.gaps) else None,
+            first_meal=float(first[recent].mean()),
+            last_meal=float(last[recent].mean()),
+            # Spread of when the day's first/last meal happens across recent days
+            first_meal_variation_minutes=float(first[recent].std()) if recent.sum() > 1 else None,
+            last_meal_variation_minutes=float(last[recent].std()) if recent.sum() > 1 else None
+        )
+
+
+def clock_time(minute_of_day):
+    """Minutes after midnight as 'HH:MM'"""
+    minute = int(round(minute_of_day)) % _MINUTES_PER_DAY
+    return f"{minute // 60:02d}:{minute % 60:02d}"
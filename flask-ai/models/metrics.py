@@ -0,0 +1,184 @@
+"""
+Metrics - Latency histograms rendered in the Prometheus text format
+Every thread records into its own dict of series, so observe() takes no lock and
+never contends with other request threads; a scrape sums the per-thread series.
+Series of finished threads are folded into one retired total at scrape time.
+Counts are per process: each gunicorn worker reports its own.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (seconds) of the histogram buckets, +Inf implied
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_histograms = []
+_local = threading.local()
+_threads = []    # (thread, series) for every thread that has observed something
+_retired = {}    # series of threads that have exited
+_lock = threading.Lock()
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()  # may have been held by another thread at fork()
+
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def _thread_series():
+    series = getattr(_local, 'series', None)
+    if series is None:
+        series = _local.series = {}
+        with _lock:
+            _threads.append((threading.current_thread(), series))
+    return series
+
+
+def _merge(into, series):
+    for key, cell in list(series.items()):
+        total = into.get(key)
+        if total is None:
+            into[key] = list(cell)
+        else:
+            for index, value in enumerate(cell):
+                total[index] += value
+
+
+class Histogram:
+    """A histogram family; label values are passed positionally to observe()"""
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        _histograms.append(self)
+
+    def observe(self, value, *labels):
+        series = _thread_series()
+        cell = series.get((self, labels))
+        if cell is None:
+            # Per-bucket counts (last one is +Inf), then the sum of observed values
+            cell = series[(self, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+
+REQUEST_SECONDS = Histogram(
+    'fitness_ai_request_duration_seconds', 'Request latency by endpoint', ('endpoint', 'method', 'status')
+)
+INFERENCE_SECONDS = Histogram(
+    'fitness_ai_inference_duration_seconds', 'Forest inference (predict_proba) time per call',
+    ('model', 'mode')
+)
+RULE_ENGINE_SECONDS = Histogram(
+    'fitness_ai_rule_engine_duration_seconds',
+    'Analyzer time excluding the ML category lookup (rules, trends, history windows)', ('analyzer',)
+)
+
+
+def excluded_from_rules(func):
+    """Time spent in func is not counted as rule-engine time of the analyzer calling it"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if getattr(_local, 'excluded', None) is not None:
+                _local.excluded += time.perf_counter() - started
+    return wrapper
+
+
+def rule_engine_timer(analyzer):
+    """Record the decorated analyzer's time, minus its excluded_from_rules calls, in RULE_ENGINE_SECONDS"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_local, 'excluded', None)
+            _local.excluded = 0.0
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                RULE_ENGINE_SECONDS.observe(time.perf_counter() - started - _local.excluded, analyzer)
+                _local.excluded = outer
+        return wrapper
+    return decorator
+
+
+def collect():
+    """Summed series of all threads: {(histogram, labels): cell}"""
+    with _lock:
+        alive = []
+        for thread, series in _threads:
+            if thread.is_alive():
+                alive.append((thread, series))
+            else:
+                _merge(_retired, series)  # it can no longer write to it
+        _threads[:] = alive
+        totals = {}
+        _merge(totals, _retired)
+        for _, series in alive:
+            _merge(totals, series)
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_family(name, kind, documentation, samples, labelnames=()):
+    """Text exposition of a counter/gauge family; samples are (label values, value) pairs"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f'{name}{_labels(labelnames, labels)} {_number(value)}')
+    return lines
+
+
+def render_histograms():
+    """Text exposition lines of every histogram"""
+    totals = collect()
+    lines = []
+    for histogram in _histograms:
+        lines.append(f'# HELP {histogram.name} {histogram.documentation}')
+        lines.append(f'# TYPE {histogram.name} histogram')
+        series = sorted(
+            (labels, cell) for (owner, labels), cell in totals.items() if owner is histogram
+        )
+        bounds = [_number(bound) for bound in histogram.buckets] + ['+Inf']
+        for labels, cell in series:
+            names = histogram.labelnames + ('le',)
+            cumulative = 0
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                lines.append(f'{histogram.name}_bucket{_labels(names, labels + (bound,))} {cumulative}')
+            base = _labels(histogram.labelnames, labels)
+            lines.append(f'{histogram.name}_sum{base} {_number(cell[-1])}')
+            lines.append(f'{histogram.name}_count{base} {cumulative}')
+    return lines
@@ -3,61 +3,222 @@ Model Manager - Lazy loading for ML models to prevent Render free tier timeout
 Loads models on first request instead of at import time
 """
 import os
+import sys
 import logging
 import gc
 import time
+import hashlib
+import importlib
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from models.metrics import INFERENCE_SECONDS
 
 logger = logging.getLogger(__name__)
 
-# Model cache
-_models = {}
+# Models served by this app and the recommender module that loads and warms each one
+MODEL_NAMES = ('diet', 'stress', 'workout')
+_RECOMMENDER_MODULES = {
+    'diet': 'models.diet_recommender',
+    'stress': 'models.stress_analysis',
+    'workout': 'models.workout_recommender'
+}
+
+# Recommender modules pull in numpy (and sklearn when unpickling) - they are imported on
+# first use or by warm_imports(), never when the app itself is imported
+PRELOAD_IMPORTS = os.getenv('PRELOAD_IMPORTS', 'true').lower() == 'true'
+_import_timings = []
+_import_timings_lock = threading.Lock()
+
+# Model cache - loaded models live in _published (below); _model_status only records
+# why a model is not loaded ('fallback' or 'error: ...')
 _model_load_times = {}
 _model_status = {}
+_model_warm_latency = {}
+
+# Single-flight loading: the first caller for a model loads it, later callers wait on its Future
+_load_lock = threading.Lock()
+_loads_in_flight = {}
+_reloads_in_flight = set()
+
+# Hot reload: poll the model files every MODEL_RELOAD_INTERVAL seconds (0 disables polling;
+# POST /api/admin/reload still works) and swap in new versions without a restart
+MODEL_RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL', 0))
+_watched_mtimes = {}
+_watcher_thread = None
+
+# Everything a recommender needs to score requests. Recommenders publish one of these
+# with a single assignment, so readers see either no model or a complete one.
+LoadedModel = namedtuple('LoadedModel', ['engine', 'feature_names', 'feature_spec', 'info'])
+
+# Model name -> its published LoadedModel: the one source of the served model, its
+# version and its 'loaded' status. Models are NOT loaded at import time; the first
+# current_model() call loads one through get_model().
+_published = {}
+
+# Marks that the ML result has not been computed by the caller yet
+ML_NOT_COMPUTED = object()
+
+# {model name: version} of the models this thread predicted with (see track_model_versions)
+_versions_used = threading.local()
+
+# Opt-in micro-batching of concurrent single-user predictions (useful with gthread workers)
+INFERENCE_BATCHING = os.getenv('INFERENCE_BATCHING', 'false').lower() == 'true'
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', 5))
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv('INFERENCE_BATCH_MAX_SIZE', 32))
+INFERENCE_RESULT_TIMEOUT = 30  # Seconds a request waits for its batch before giving up
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def timed_import(module_name):
+    """
+    Import a module, recording its cumulative import time and the number of modules it
+    pulled in when this call is the one that loads it (the -X importtime view of startup).
+    Always goes through importlib so a module another thread is still importing is awaited.
+    """
+    already_loaded = module_name in sys.modules
+    modules_before = len(sys.modules)
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not already_loaded:
+        elapsed = time.perf_counter() - start
+        with _import_timings_lock:
+            if all(name != module_name for name, _, _ in _import_timings):
+                _import_timings.append((module_name, elapsed, len(sys.modules) - modules_before))
+    return module
+
 
+def get_recommender(model_name):
+    """The recommender module for a model, imported on first use"""
+    return timed_import(_RECOMMENDER_MODULES[model_name])
 
-def get_model(model_name):
+
+def warm_imports(async_mode=True):
+    """
+    Import the scientific stack and the recommender modules ahead of the first request,
+    then log the import report (disabled by PRELOAD_IMPORTS=false). Models are not loaded.
+    Returns the background thread when async_mode is True.
+    """
+    if not PRELOAD_IMPORTS:
+        return None
+    module_names = ['numpy']
+    engine = os.getenv('INFERENCE_ENGINE', 'auto').lower()
+    if engine == 'sklearn' or (engine == 'auto' and not _artifacts_present()):
+        # The sklearn engine unpickles the saved Pipeline (the compiled one memory-maps arrays)
+        module_names += ['joblib', 'sklearn.pipeline', 'sklearn.preprocessing', 'sklearn.ensemble']
+    module_names += [_RECOMMENDER_MODULES[model_name] for model_name in MODEL_NAMES]
+    
+    def _warm():
+        start = time.perf_counter()
+        for module_name in module_names:
+            try:
+                timed_import(module_name)
+            except Exception as e:
+                logger.error(f"❌ Failed to import {module_name}: {e}")
+        logger.info(f"📦 Deferred imports finished in {(time.perf_counter() - start) * 1000:.0f}ms")
+        for line in import_report():
+            logger.info(line)
+    
+    if not async_mode:
+        _warm()
+        return None
+    thread = threading.Thread(target=_warm, daemon=True, name='import_warmer')
+    thread.start()
+    return thread
+
+
+def _artifacts_present():
+    """Whether every model has an exported .forest artifact (INFERENCE_ENGINE=auto memory-maps them)"""
+    models_dir = os.path.dirname(os.path.abspath(__file__))
+    return all(
+        os.path.exists(os.path.join(models_dir, f'{model_name}_model.forest', 'manifest.json'))
+        for model_name in MODEL_NAMES
+    )
+
+
+def get_import_timings():
+    """Deferred imports so far, in the order they happened"""
+    with _import_timings_lock:
+        return [
+            {'module': name, 'cumulative_ms': round(elapsed * 1000, 1), 'modules_loaded': count}
+            for name, elapsed, count in _import_timings
+        ]
+
+
+def import_report():
+    """Deferred imports formatted like python -X importtime"""
+    lines = ['import time: cumulative [ms] | modules | imported package']
+    for timing in get_import_timings():
+        lines.append(f"import time: {timing['cumulative_ms']:>15} | {timing['modules_loaded']:>7} | {timing['module']}")
+    return lines
+
+
+def get_model(model_name, retry=True):
     """
     Lazy load models on first request.
     Returns the model data or None if not available.
+    Concurrent callers share one load; retry=False returns None straight away
+    if an earlier attempt already fell back instead of loading again.
     """
-    global _models, _model_load_times, _model_status
-    
     # Return cached model if available
-    if model_name in _models:
-        return _models[model_name]
+    model_data = _model_info(model_name)
+    if model_data is not None:
+        return model_data
     
-    # Lazy load the model
+    with _load_lock:
+        model_data = _model_info(model_name)
+        if model_data is not None:
+            return model_data
+        if not retry and model_name in _model_status:
+            return None
+        future = _loads_in_flight.get(model_name)
+        leader = future is None
+        if leader:
+            future = _loads_in_flight[model_name] = Future()
+    
+    if not leader:
+        # Another thread is already loading this model - wait for its result
+        return future.result()
+    
+    model_data = None
+    try:
+        model_data = _load_model(model_name)
+    finally:
+        with _load_lock:
+            del _loads_in_flight[model_name]
+        future.set_result(model_data)
+    return model_data
+
+
+def _load_model(model_name):
+    """Load one model and record its status (called by the single-flight leader only)"""
     start_time = time.time()
     logger.info(f"🔄 Lazy loading {model_name} model...")
     
     try:
         if model_name == 'diet':
-            from models.diet_recommender import load_model as load_diet_model
+            load_diet_model = get_recommender('diet').load_model
             model_data = load_diet_model()
-            if model_data:
-                _models[model_name] = model_data
-                _model_status[model_name] = 'loaded'
-            else:
+            if not model_data:
                 _model_status[model_name] = 'fallback'
                 return None
                 
         elif model_name == 'stress':
-            from models.stress_analysis import load_model as load_stress_model
+            load_stress_model = get_recommender('stress').load_model
             model_data = load_stress_model()
-            if model_data:
-                _models[model_name] = model_data
-                _model_status[model_name] = 'loaded'
-            else:
+            if not model_data:
                 _model_status[model_name] = 'fallback'
                 return None
                 
         elif model_name == 'workout':
-            from models.workout_recommender import load_model as load_workout_model
+            load_workout_model = get_recommender('workout').load_model
             model_data = load_workout_model()
-            if model_data:
-                _models[model_name] = model_data
-                _model_status[model_name] = 'loaded'
-            else:
+            if not model_data:
                 _model_status[model_name] = 'fallback'
                 return None
         else:
@@ -71,7 +232,7 @@ def get_model(model_name):
         # Force garbage collection after model load to free memory
         gc.collect()
         
-        return _models.get(model_name)
+        return _model_info(model_name)
         
     except Exception as e:
         logger.error(f"❌ Error loading {model_name} model: {e}")
@@ -79,23 +240,400 @@ def get_model(model_name):
         return None
 
 
+def _model_info(model_name):
+    """Info dict of the published model, or None while it is not loaded"""
+    loaded = _published.get(model_name)
+    return loaded.info if loaded is not None else None
+
+
+def _status(model_name):
+    return 'loaded' if model_name in _published else _model_status.get(model_name, 'not_loaded')
+
+
 def get_model_status():
     """Return current status of all models"""
+    published = dict(_published)
     return {
-        'loaded_models': list(_models.keys()),
-        'model_status': _model_status,
-        'load_times': _model_load_times
+        'loaded_models': list(published),
+        'model_status': {model_name: _status(model_name)
+                         for model_name in MODEL_NAMES if _status(model_name) != 'not_loaded'},
+        'load_times': dict(_model_load_times),
+        'versions': {model_name: loaded.info.get('version') for model_name, loaded in published.items()},
+        'reloading': sorted(_reloads_in_flight)
     }
 
 
+def model_file_version(path):
+    """Content checksum of a model file, used as its version"""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_model_version(model_name):
+    """Version of the model currently served (None while it is not loaded)"""
+    model_data = _model_info(model_name)
+    return model_data.get('version') if model_data else None
+
+
+def reload_model(model_name):
+    """
+    Load a fresh copy of a model from disk, warm it, then swap it in atomically:
+    one publish_model() call changes the served model, its version and its warm latency.
+    Requests already running finish on the model object they started with.
+    Returns the new version, or None if the reload failed (the old model keeps serving).
+    """
+    with _load_lock:
+        if model_name in _reloads_in_flight:
+            return None
+        _reloads_in_flight.add(model_name)
+    try:
+        start_time = time.time()
+        previous_version = get_model_version(model_name)
+        logger.info(f"🔄 Reloading {model_name} model (serving version {previous_version})...")
+        model_data = get_recommender(model_name).load_model(reload=True)
+        if not model_data:
+            logger.warning(f"⚠️ Reload of {model_name} model failed, keeping version {previous_version}")
+            return None
+        _model_load_times[model_name] = time.time() - start_time
+        gc.collect()
+        logger.info(f"✅ {model_name} model swapped to version {model_data.get('version')} "
+                    f"in {time.time() - start_time:.2f}s")
+        return model_data.get('version')
+    except Exception as e:
+        logger.error(f"❌ Error reloading {model_name} model: {e}")
+        return None
+    finally:
+        with _load_lock:
+            _reloads_in_flight.discard(model_name)
+
+
+def check_for_update(model_name):
+    """Reload a loaded model if its file on disk holds a different version. Returns True if reloaded."""
+    if model_name not in _published:
+        return False
+    path = get_recommender(model_name).MODEL_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        # Cheap mtime check first - the checksum only runs when the file was touched
+        if _watched_mtimes.get(model_name) == mtime:
+            return False
+        version = model_file_version(path)
+    except OSError:
+        return False
+    _watched_mtimes[model_name] = mtime
+    if version == get_model_version(model_name):
+        return False
+    return reload_model(model_name) is not None
+
+
+def reload_models_async(model_names=None):
+    """Reload the given (default: all loaded) models in a background thread; returns the thread"""
+    model_names = list(model_names or _published.keys())
+    thread = threading.Thread(
+        target=lambda: [reload_model(model_name) for model_name in model_names],
+        daemon=True, name='model_reloader'
+    )
+    thread.start()
+    return thread
+
+
+def start_reload_watcher(interval=None):
+    """Start polling the loaded models' files for new versions (no-op when the interval is 0)"""
+    global _watcher_thread
+    interval = MODEL_RELOAD_INTERVAL if interval is None else interval
+    if interval <= 0 or (_watcher_thread is not None and _watcher_thread.is_alive()):
+        return _watcher_thread
+
+    def _watch():
+        while True:
+            time.sleep(interval)
+            for model_name in list(_published.keys()):
+                check_for_update(model_name)
+
+    _watcher_thread = threading.Thread(target=_watch, daemon=True, name='model_watcher')
+    _watcher_thread.start()
+    logger.info(f"👀 Watching model files for new versions every {interval:g}s")
+    return _watcher_thread
+
+
 def clear_models():
-    """Clear all loaded models to free memory (useful for health checks)"""
-    global _models
-    _models.clear()
+    """
+    Clear all loaded models to free memory (useful for health checks). Their status is
+    reset too, so the next request loads them again instead of settling on the fallback.
+    """
+    with _load_lock:
+        _published.clear()
+        _model_status.clear()
+        _model_warm_latency.clear()
+        _model_load_times.clear()
     gc.collect()
     logger.info("🧹 Cleared all loaded models from memory")
 
 
 def is_model_ready(model_name):
     """Check if a model is loaded and ready"""
-    return model_name in _models
+    return model_name in _published
+
+
+def measure_warm_latency(loaded, records, rounds=5):
+    """
+    Score records once as a batch, then row by row; returns the median single-row
+    latency in ms. The first passes absorb one-off allocations and lazy imports.
+    """
+    loaded.engine.predict_proba(loaded.feature_spec.matrix(records))
+    timings = []
+    for _ in range(rounds):
+        for record in records:
+            start = time.perf_counter()
+            loaded.engine.predict_proba(loaded.feature_spec.row(record))
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def publish_model(model_name, loaded, warm_records):
+    """
+    Make a LoadedModel the one requests use (a single dict assignment). It first scores
+    warm_records, so first-call allocations happen before real traffic and the model -
+    whether preloaded, lazily loaded by a request or hot-reloaded - is published warm.
+    """
+    warm_latency_ms = measure_warm_latency(loaded, warm_records)
+    _model_status.pop(model_name, None)
+    _model_warm_latency[model_name] = round(warm_latency_ms, 3)
+    _published[model_name] = loaded
+    logger.info(f"🔥 {model_name} model warm: {warm_latency_ms:.2f}ms per prediction")
+
+
+def published_model(model_name):
+    """The LoadedModel requests currently use, or None - never triggers a load"""
+    return _published.get(model_name)
+
+
+def current_model(model_name):
+    """The published model, loading it through get_model on first use (None if unavailable)"""
+    loaded = _published.get(model_name)
+    if loaded is None:
+        # Single-flight: concurrent first requests wait for one load instead of starting their own
+        get_model(model_name, retry=False)
+        loaded = _published.get(model_name)
+    return loaded
+
+
+@contextmanager
+def track_model_versions():
+    """
+    Collect {model name: version} of every LoadedModel this thread predicts with inside
+    the block - the versions a response was actually computed by, even when a hot reload
+    swaps the published model in the meantime.
+    """
+    outer = getattr(_versions_used, 'versions', None)
+    versions = _versions_used.versions = {}
+    try:
+        yield versions
+    finally:
+        _versions_used.versions = outer
+
+
+def _record_version(model_name, loaded):
+    versions = getattr(_versions_used, 'versions', None)
+    if versions is not None:
+        versions[model_name] = loaded.info['version']
+
+
+def ml_result_from_probabilities(probabilities, classes):
+    """Build the ML result dict from one row of predict_proba output"""
+    best = max(range(len(probabilities)), key=probabilities.__getitem__)  # first on ties, like argmax
+    return {
+        'category': classes[best],
+        'confidence': float(probabilities[best]),
+        'all_probabilities': dict(zip(classes, probabilities))
+    }
+
+
+def predict_record(model_name, record, batch_fn, memo=None, log=logger):
+    """
+    ML result for one record of a model's inputs, or None if the model is unavailable.
+    Served from memo (a QuantizedMemo) when a nearby record was already scored, through
+    the micro-batching scheduler (batch_fn scores a list of records) when enabled, else
+    by one predict_proba pass. Raises on malformed records.
+    """
+    loaded = current_model(model_name)
+    if loaded is None:
+        return None
+    _record_version(model_name, loaded)
+
+    # Fails fast on malformed values before they can join a shared batch
+    features = loaded.feature_spec.row(record)
+
+    # Reuse the prediction already made for this bucket of nearby inputs
+    # Keyed by model version so results from a replaced model are never served
+    memo_key = None
+    if memo is not None and memo.enabled:
+        memo_key = (loaded.info['version'],) + memo.key(record)
+        ml_result = memo.get(memo_key)
+        if ml_result is not None:
+            return ml_result
+
+    # Coalesce with concurrent requests when micro-batching is enabled
+    scheduler = get_inference_scheduler(model_name, batch_fn)
+    if scheduler is not None:
+        ml_result = scheduler.submit(record)
+    else:
+        # Single probability pass - the category is the most probable class
+        with INFERENCE_SECONDS.time(model_name, 'single'):
+            probabilities = loaded.engine.predict_proba(features)[0]
+        ml_result = ml_result_from_probabilities(probabilities, loaded.engine.classes_)
+        log.info("ML prediction: %s, probabilities: %s", ml_result['category'], probabilities,
+                 extra={'payload': True})
+
+    if memo_key is not None and ml_result is not None:
+        memo.set(memo_key, ml_result)
+    return ml_result
+
+
+def predict_records(model_name, records, log=logger):
+    """
+    ML results for many records with a single predict_proba call
+    (all None if the model is unavailable). Raises on malformed records.
+    """
+    loaded = current_model(model_name) if records else None
+    if loaded is None:
+        return [None] * len(records)
+    _record_version(model_name, loaded)
+
+    features = loaded.feature_spec.matrix(records)
+
+    with INFERENCE_SECONDS.time(model_name, 'batch'):
+        probabilities = loaded.engine.predict_proba(features)
+    log.info("ML batch prediction for %d %s records", len(records), model_name)
+    return [ml_result_from_probabilities(row, loaded.engine.classes_) for row in probabilities]
+
+
+def get_readiness():
+    """
+    Return (ready, per-model details). Ready once every model is loaded and warmed,
+    or has settled on the rule-based fallback because it could not be loaded.
+    """
+    ready = True
+    details = {}
+    for model_name in MODEL_NAMES:
+        status = _status(model_name)
+        warm_latency_ms = _model_warm_latency.get(model_name)
+        if status == 'loaded':
+            settled = warm_latency_ms is not None
+        else:
+            settled = status != 'not_loaded' and model_name not in _loads_in_flight
+        ready = ready and settled
+        details[model_name] = {
+            'status': status,
+            'warm': warm_latency_ms is not None,
+            'warm_latency_ms': warm_latency_ms,
+            'load_time_s': _model_load_times.get(model_name)
+        }
+    return ready, details
+
+
+class InferenceScheduler:
+    """
+    Coalesces concurrent single-row predictions into batched model calls.
+    Requests queue up for at most window_ms (or until max_batch_size rows are waiting),
+    then the whole batch is scored with one call to batch_fn and each waiting
+    request receives its own result.
+    """
+    def __init__(self, name, batch_fn, window_ms=5, max_batch_size=32):
+        self.name = name
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._batch_fn = batch_fn
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches_run = 0
+        self.rows_scored = 0
+
+    def _ensure_started(self):
+        """Start the batching thread on first use (after any worker fork)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True, name=f'{self.name}_inference_batcher'
+                )
+                self._thread.start()
+
+    def submit(self, row, timeout=INFERENCE_RESULT_TIMEOUT):
+        """Queue one feature row and block until its batch has been scored"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((row, future))
+        return future.result(timeout=timeout)
+
+    def _collect_batch(self):
+        """Wait for the first row, then gather more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            rows = [row for row, _ in batch]
+            try:
+                results = self._batch_fn(rows)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error("❌ %s batched inference failed: %s", self.name, e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches_run += 1
+            self.rows_scored += len(rows)
+
+    def stats(self):
+        return {
+            'batches_run': self.batches_run,
+            'rows_scored': self.rows_scored,
+            'avg_batch_size': round(self.rows_scored / self.batches_run, 2) if self.batches_run else 0,
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size
+        }
+
+
+def get_inference_scheduler(model_name, batch_fn):
+    """
+    Return the shared micro-batching scheduler for a model,
+    or None when INFERENCE_BATCHING is disabled.
+    """
+    if not INFERENCE_BATCHING:
+        return None
+    scheduler = _schedulers.get(model_name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(model_name)
+            if scheduler is None:
+                scheduler = InferenceScheduler(
+                    model_name,
+                    batch_fn,
+                    window_ms=INFERENCE_BATCH_WINDOW_MS,
+                    max_batch_size=INFERENCE_BATCH_MAX_SIZE
+                )
+                _schedulers[model_name] = scheduler
+    return scheduler
+
+
+def get_scheduler_stats():
+    """Return batching statistics per model (empty when batching is disabled)"""
+    return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
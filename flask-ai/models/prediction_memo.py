@@ -0,0 +1,80 @@
+"""
+Prediction Memo - Bounded LRU of ML results keyed on quantized feature records
+Nearby inputs (e.g. intakes within 25 kcal, heart rates within 5 bpm) share one
+bucket, so the forest only runs for the first request that lands in a bucket.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+# Entries kept per model; 0 disables the memo
+PREDICTION_MEMO_SIZE = int(os.getenv('PREDICTION_MEMO_SIZE', 2048))
+
+
+def parse_steps(env_name, default):
+    """Read comma-separated bucket sizes from an env var, falling back to default"""
+    raw = os.getenv(env_name)
+    if not raw:
+        return tuple(default)
+    return tuple(float(step) for step in raw.split(','))
+
+
+class QuantizedMemo:
+    """
+    LRU memo of ML results. steps gives one bucket size per numeric record field;
+    fields listed in categorical are matched exactly.
+    """
+    def __init__(self, steps, categorical=(), max_size=PREDICTION_MEMO_SIZE):
+        self.steps = tuple(steps)
+        self.categorical = frozenset(categorical)
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def key(self, record):
+        """Map a record to its bucket; raises TypeError/ValueError for non-numeric values"""
+        key = []
+        steps = iter(self.steps)
+        for index, value in enumerate(record):
+            if index in self.categorical:
+                key.append(value)
+            else:
+                key.append(math.floor(float(value) / next(steps)))
+        return tuple(key)
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def set(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'steps': self.steps
+        }
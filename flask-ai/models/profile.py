@@ -0,0 +1,151 @@
+"""
+Profile - Shared parsing of user_data for the diet, workout and stress recommenders
+Age and the values derived from it (age group, max heart rate, base calories) are
+computed once per (dateOfBirth, gender) and kept in a bounded LRU. Ages change at
+midnight, so the memo is dropped whenever the local date rolls over.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+# Profiles kept in the memo; 0 disables it
+PROFILE_MEMO_SIZE = int(os.getenv('PROFILE_MEMO_SIZE', 4096))
+
+# Max heart rate used when the age is unknown
+DEFAULT_MAX_HEART_RATE = 180
+
+Profile = namedtuple('Profile', ['age', 'gender', 'age_group', 'max_heart_rate', 'base_calories'])
+
+
+def parse_birth_date(date_of_birth):
+    """
+    dateOfBirth as a date, or None. Accepts '%Y-%m-%d' and ISO datetimes such as the
+    '2000-01-31T00:00:00.000Z' the backend sends; only the date part is used.
+    """
+    try:
+        return datetime.strptime(date_of_birth.split('T')[0], '%Y-%m-%d').date()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def age_on(born, today):
+    """Whole years between born and today"""
+    age = today.year - born.year
+    if (today.month, today.day) < (born.month, born.day):
+        age -= 1
+    return age
+
+
+def age_group(age):
+    """'young_adult' (< 25), 'adult' (25-39), 'mid_life' (40+), or None when age is unknown"""
+    if age is None:
+        return None
+    if age < 25:
+        return 'young_adult'
+    if age < 40:
+        return 'adult'
+    return 'mid_life'
+
+
+def calculate_max_heart_rate(age):
+    """Calculate maximum heart rate using Tanaka formula"""
+    return 208 - (0.7 * age)
+
+
+def base_calories(age, gender):
+    """Daily calorie baseline by gender and age, or None without both"""
+    if not age:
+        return None
+    if gender == 'female':
+        return 2000 if age < 50 else 1800
+    if gender == 'male':
+        return 2500 if age < 50 else 2200
+    return None
+
+
+def _build(date_of_birth, gender, today):
+    age = None
+    if date_of_birth:
+        born = parse_birth_date(date_of_birth)
+        if born is None:
+            logger.error("Failed to parse date of birth: %s", date_of_birth)
+        else:
+            age = age_on(born, today)
+    return Profile(
+        age=age,
+        gender=gender,
+        age_group=age_group(age),
+        max_heart_rate=calculate_max_heart_rate(age) if age else None,
+        base_calories=base_calories(age, gender)
+    )
+
+
+class ProfileMemo:
+    """LRU of Profiles keyed on the raw (dateOfBirth, gender), valid for one local day"""
+    def __init__(self, max_size=PROFILE_MEMO_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._day = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rollovers = 0
+
+    def get(self, date_of_birth, gender):
+        today = date.today()
+        key = (date_of_birth, gender)
+        try:
+            hash(key)
+        except TypeError:
+            return _build(date_of_birth, gender, today)  # Malformed JSON values aren't memoized
+        with self._lock:
+            if today != self._day:
+                if self._entries:
+                    self.rollovers += 1
+                self._entries.clear()
+                self._day = today
+            profile = self._entries.get(key)
+            if profile is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return profile
+            self.misses += 1
+
+        profile = _build(date_of_birth, gender, today)
+        if self.max_size > 0:
+            with self._lock:
+                if self._day == today:
+                    self._entries[key] = profile
+                    if len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return profile
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rollovers': self.rollovers
+        }
+
+
+_memo = ProfileMemo()
+
+
+def get_profile(user_data):
+    """Profile of a request's user_data; O(1) for a (dateOfBirth, gender) seen today"""
+    user_data = user_data if isinstance(user_data, dict) else {}
+    return _memo.get(user_data.get('dateOfBirth'), user_data.get('gender', 'other'))
+
+
+def get_profile_memo_stats():
+    return _memo.stats()
@@ -1,42 +1,92 @@
-import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-import joblib
 import os
-from datetime import datetime
+import time
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+from models.model_manager import (
+    LoadedModel, ML_NOT_COMPUTED, model_file_version, predict_record, predict_records, publish_model,
+    published_model
+)
+from models.forest_engine import load_engine, GridLookupEngine
+from models.feature_spec import FeatureSpec, Numeric, OneHot
+from models.trend_engine import analyze_trends, empty_trend, TrendState
+from models.profile import get_profile
+from models.metrics import excluded_from_rules, rule_engine_timer
+
+# Set up logging - handlers are configured by the app (log_config.py)
 logger = logging.getLogger(__name__)
+# Request bodies and per-request results are logged with this extra= and sampled
+_PAYLOAD = {'payload': True}
 
 # Get current directory and model path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, 'stress_model.pkl')
 
-# Load model at module level - LAZY LOADING: model is NOT loaded at import time
-_model_data = None
-_model = None
-_feature_names = None
-_model_loaded = False
-
-def load_model():
-    """Load the trained stress model - Returns model data dict or None"""
-    global _model_data, _model, _feature_names, _model_loaded
-    
+# 'model' keeps the forest resident; 'table' precomputes every mood x stress x sleep
+# combination at load time and serves predictions by index lookup
+STRESS_MODEL_MODE = os.getenv('STRESS_MODEL_MODE', 'model').lower()
+STRESS_TABLE_RESOLUTION = float(os.getenv('STRESS_TABLE_RESOLUTION', 0.1))
+# Check-in sliders are 0-10; values outside are clamped to the table edge
+STRESS_INPUT_RANGE = (0.0, 10.0)
+
+# Model inputs, in the order records are passed to the compiled spec
+STRESS_FEATURES = FeatureSpec(
+    OneHot('mood', ('happy', 'sad', 'anxious', 'neutral')),
+    Numeric('stress_level'),
+    Numeric('sleep_quality')
+)
+
+# Synthetic check-ins scored by model_manager.publish_model() before the model takes traffic
+# (mood, stress_level, sleep_quality)
+WARMUP_RECORDS = [
+    ('happy', 2, 8),
+    ('sad', 7, 3),
+    ('anxious', 9, 2),
+    ('neutral', 5, 5)
+]
+
+def _build_lookup_table(engine, feature_names, resolution):
+    """Evaluate the model over the full check-in grid (see STRESS_MODEL_MODE)"""
+    low, high = STRESS_INPUT_RANGE
+    return GridLookupEngine.build(
+        engine,
+        n_features=len(feature_names),
+        one_hot_columns=[i for i, name in enumerate(feature_names) if name.startswith('mood_')],
+        numeric_ranges=[
+            (feature_names.index('stress_level'), low, high),
+            (feature_names.index('sleep_quality'), low, high)
+        ],
+        resolution=resolution
+    )
+
+def load_model(engine=None, mode=None, reload=False):
+    """
+    Load the trained stress model - Returns model data dict or None
+    engine: 'auto', 'sklearn' or 'compiled' (defaults to the INFERENCE_ENGINE env var)
+    mode: 'model' or 'table' (defaults to the STRESS_MODEL_MODE env var)
+    reload: load a fresh copy from disk, warm it and swap it in (the old model serves until then)
+    """
     # Return already loaded model data
-    if _model_loaded and _model_data is not None:
-        return _model_data
+    published = published_model('stress')
+    if published is not None and not reload:
+        return published.info
     
     try:
         if os.path.exists(MODEL_PATH):
             logger.info(f"🔄 Loading stress model from {MODEL_PATH}...")
-            _model_data = joblib.load(MODEL_PATH)
-            _model = _model_data["pipeline"]
-            _feature_names = _model_data["feature_names"]
-            _model_loaded = True
-            logger.info(f"✅ Stress model loaded successfully")
-            return _model_data
+            version = model_file_version(MODEL_PATH)
+            model, feature_names = load_engine(MODEL_PATH, engine, version)
+            feature_spec = STRESS_FEATURES.compile(feature_names)
+            if (mode or STRESS_MODEL_MODE) == 'table':
+                start_time = time.time()
+                model = _build_lookup_table(model, list(feature_names), STRESS_TABLE_RESOLUTION)
+                logger.info(f"📋 Stress lookup table built in {time.time() - start_time:.2f}s "
+                            f"({model.table.size} probabilities, {model.table.nbytes / 1024:.0f} KB)")
+            info = {"feature_names": feature_names, "engine": model.name, "version": version}
+            loaded = LoadedModel(model, feature_names, feature_spec, info)
+            # Warmed before it takes traffic; on reload, requests in flight keep the old model
+            publish_model('stress', loaded, WARMUP_RECORDS)
+            logger.info(f"✅ Stress model loaded successfully ({model.name} engine, version {version})")
+            return info
         else:
             logger.warning(f"Stress model not found at {MODEL_PATH}, using rule-based fallback")
             return None
@@ -47,310 +97,163 @@ def load_model():
 # NOTE: Removed automatic model loading at import time for Render free tier compatibility
 # load_model()  # <-- This was causing timeout issues on Render
 
-def calculate_age(date_of_birth):
-    """Calculate age from date of birth"""
-    if not date_of_birth:
-        return None
-        
-    try:
-        today = datetime.now()
-        born = datetime.strptime(date_of_birth, '%Y-%m-%d')
-        age = today.year - born.year
-        if today.month < born.month or (today.month == born.month and today.day < born.day):
-            age -= 1
-        return age
-    except Exception as e:
-        logger.error(f"Error calculating age: {e}")
-        return None
-
+@excluded_from_rules
 def get_ml_stress_category(mood, stress_level, sleep_quality):
     """Get stress category prediction from ML model"""
     try:
-        if _model is None:
-            return None
-        
-        # One-hot encode mood
-        mood_dummies = {}
-        possible_moods = ['happy', 'sad', 'anxious', 'neutral']
-        
-        for m in possible_moods:
-            mood_dummies[f'mood_{m}'] = 1 if mood == m else 0
-        
-        # Create feature vector
-        features = pd.DataFrame([{
-            **mood_dummies,
-            'stress_level': stress_level,
-            'sleep_quality': sleep_quality
-        }])
-        
-        # Ensure correct feature order
-        features = features[_feature_names]
-        
-        # Get prediction
-        prediction = _model.predict(features)[0]
-        probabilities = _model.predict_proba(features)[0]
-        
-        logger.info(f"ML prediction: {prediction}, probabilities: {probabilities}")
-        return {
-            'category': prediction,
-            'confidence': float(max(probabilities)),
-            'all_probabilities': dict(zip(_model.classes_, probabilities))
-        }
+        return predict_record('stress', (mood, stress_level, sleep_quality), get_ml_stress_categories_batch, log=logger)
     except Exception as e:
-        logger.error(f"Error getting ML stress category: {e}")
+        logger.error("Error getting ML stress category: %s", e)
         return None
 
-def calculate_time_weights(logs, decay_factor=0.7):
+def get_ml_stress_categories_batch(check_ins):
     """
-    Calculate time-decay weights for logs.
-    More recent logs get higher weights.
-    decay_factor: 0.0-1.0, higher = faster decay (more weight to recent)
+    Get stress categories for many check-ins with a single predict_proba call.
+    check_ins: list of (mood, stress_level, sleep_quality) tuples
+    Returns a list of ML result dicts (all None if the model is unavailable).
     """
     try:
-        if not logs:
-            return []
-        
-        # Parse dates and find most recent
-        dates = []
-        for log in logs:
-            date_str = log.get('date', '')
-            try:
-                # Handle ISO format
-                date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                dates.append(date)
-            except:
-                dates.append(datetime.now())
-        
-        if not dates:
-            return [1.0] * len(logs)
-        
-        most_recent = max(dates)
-        
-        # Calculate weights based on days ago
-        weights = []
-        for date in dates:
-            days_ago = (most_recent - date).days
-            # Exponential decay: weight = decay_factor ^ days_ago
-            weight = decay_factor ** max(0, days_ago)
-            weights.append(weight)
-        
-        # Normalize weights to sum to 1
-        total_weight = sum(weights)
-        if total_weight > 0:
-            weights = [w / total_weight for w in weights]
-        
-        return weights
+        return predict_records('stress', check_ins, log=logger)
     except Exception as e:
-        logger.error("Error calculating time weights: %s", str(e))
-        return [1.0 / len(logs)] * len(logs) if logs else []
-
+        logger.error("Error getting batch ML stress categories: %s", str(e))
+        return [None] * len(check_ins)
 
 def analyze_stress_pattern(logs):
     """
     Analyze stress level patterns with time-weighted analysis.
     More recent check-ins have higher influence on trend.
     """
-    try:
-        if not logs:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
-        
-        # Need at least 2 logs for any trend analysis
-        if len(logs) < 2:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'insufficient'}
-        
-        stress_levels = [log.get('stressLevel', 5) for log in logs]
-        weights = calculate_time_weights(logs, decay_factor=0.8)
-        
-        # Calculate weighted average
-        weighted_avg = np.average(stress_levels, weights=weights)
-        
-        # Calculate trend using linear regression on weighted data
-        x = np.arange(len(stress_levels))
-        # Weight the recent points more in regression
-        slope = np.polyfit(x, stress_levels, 1, w=weights)[0]
-        
-        # Calculate volatility (consistency)
-        weighted_std = np.sqrt(np.average((np.array(stress_levels) - weighted_avg)**2, weights=weights))
-        if weighted_std < 0.8:
-            volatility = 'consistent'
-        elif weighted_std < 1.5:
-            volatility = 'moderate'
-        else:
-            volatility = 'fluctuating'
-        
-        # Determine trend with more nuanced thresholds
-        if slope > 0.5:
-            trend = 'increasing'
-        elif slope < -0.5:
-            trend = 'decreasing'
-        else:
-            trend = 'stable'
-        
-        return {
-            'trend': trend,
-            'data_sufficient': len(logs) >= 3,
-            'volatility': volatility,
-            'weighted_avg': round(weighted_avg, 1)
-        }
-    except Exception as e:
-        logger.error("Error analyzing stress pattern: %s", str(e))
-        return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
+    return analyze_trends(logs)['stress']
 
 
 def analyze_sleep_pattern(logs):
     """
     Analyze sleep quality patterns with time-weighted analysis.
     """
-    try:
-        if not logs:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
-        
-        if len(logs) < 2:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'insufficient'}
-        
-        sleep_quality = [log.get('sleepQuality', 5) for log in logs]
-        weights = calculate_time_weights(logs, decay_factor=0.75)
-        
-        weighted_avg = np.average(sleep_quality, weights=weights)
-        
-        x = np.arange(len(sleep_quality))
-        slope = np.polyfit(x, sleep_quality, 1, w=weights)[0]
-        
-        weighted_std = np.sqrt(np.average((np.array(sleep_quality) - weighted_avg)**2, weights=weights))
-        if weighted_std < 0.8:
-            volatility = 'consistent'
-        elif weighted_std < 1.5:
-            volatility = 'moderate'
-        else:
-            volatility = 'fluctuating'
-        
-        # For sleep, higher is better, so positive slope = improving
-        if slope > 0.4:
-            trend = 'improving'
-        elif slope < -0.4:
-            trend = 'declining'
-        else:
-            trend = 'stable'
-        
-        return {
-            'trend': trend,
-            'data_sufficient': len(logs) >= 3,
-            'volatility': volatility,
-            'weighted_avg': round(weighted_avg, 1)
-        }
-    except Exception as e:
-        logger.error("Error analyzing sleep pattern: %s", str(e))
-        return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
+    return analyze_trends(logs)['sleep']
 
 
 def analyze_mood_pattern(logs):
     """
     Analyze mood patterns with time-weighted analysis.
     """
-    try:
-        if not logs:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
-        
-        if len(logs) < 2:
-            return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'insufficient'}
-        
-        mood_mapping = {
-            'happy': 3,
-            'neutral': 2,
-            'anxious': 1,
-            'sad': 0
-        }
-        
-        moods = [mood_mapping.get(log.get('mood', 'neutral'), 2) for log in logs]
-        weights = calculate_time_weights(logs, decay_factor=0.8)
-        
-        weighted_avg = np.average(moods, weights=weights)
-        
-        x = np.arange(len(moods))
-        slope = np.polyfit(x, moods, 1, w=weights)[0]
-        
-        weighted_std = np.sqrt(np.average((np.array(moods) - weighted_avg)**2, weights=weights))
-        if weighted_std < 0.5:
-            volatility = 'consistent'
-        elif weighted_std < 0.8:
-            volatility = 'moderate'
-        else:
-            volatility = 'fluctuating'
-        
-        # For mood, higher is better
-        if slope > 0.25:
-            trend = 'improving'
-        elif slope < -0.25:
-            trend = 'declining'
+    return analyze_trends(logs)['mood']
+
+def _current_metrics(data):
+    """
+    Extract (mood, stress_level, sleep_quality, notes) from a request payload.
+    Uses the current check-in, then the most recent log, then defaults.
+    """
+    current_check_in = data.get('current_check_in')
+    daily_logs = data.get('daily_logs', [])
+
+    if current_check_in:
+        # Use the provided current check-in data
+        source = current_check_in
+    elif daily_logs:
+        # If no current check-in but we have logs, use the most recent log
+        source = daily_logs[0]
+    else:
+        # Only use defaults if we have no data at all
+        return 'neutral', 5, 5, ''
+
+    return (
+        source.get('mood') or 'neutral',
+        source.get('stressLevel') or 5,
+        source.get('sleepQuality') or 5,
+        source.get('notes', '')
+    )
+
+def incremental_trends(store, user_id, current_check_in=None, daily_logs=None):
+    """
+    Trends from the user's stored TrendState, updated with only the new check-in.
+    A user without a stored state (or one from an older layout) is seeded once from
+    daily_logs; after that clients only need to send current_check_in.
+    """
+    def apply(record):
+        if record is not None and record[0] == TrendState.VERSION:
+            state = TrendState.from_record(record[1], record[2])
+            changed = False
         else:
-            trend = 'stable'
-        
-        return {
-            'trend': trend,
-            'data_sufficient': len(logs) >= 3,
-            'volatility': volatility,
-            'weighted_avg': round(weighted_avg, 2)
-        }
-    except Exception as e:
-        logger.error("Error analyzing mood pattern: %s", str(e))
-        return {'trend': 'neutral', 'data_sufficient': False, 'volatility': 'unknown'}
+            state = TrendState.from_logs(daily_logs)
+            changed = True
+        if isinstance(current_check_in, dict):
+            changed = state.add_check_in(current_check_in) or changed
+        new_record = (TrendState.VERSION,) + state.to_record() if changed else None
+        return new_record, state.trends()
+
+    return store.update(user_id, apply)
 
-def analyze_stress(data):
+def analyze_stress_batch(payloads):
+    """
+    Analyze stress for many users at once.
+    All check-ins are scored in one model pass, then the rule logic runs per user.
+    """
+    check_ins = []
+    scored = []
+    for index, data in enumerate(payloads):
+        try:
+            mood, stress_level, sleep_quality, _ = _current_metrics(data)
+            check_ins.append((mood, float(stress_level), float(sleep_quality)))
+            scored.append(index)
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning("Skipping ML scoring for batch item %d: %s", index, str(e))
+
+    ml_results = [None] * len(payloads)
+    for index, ml_result in zip(scored, get_ml_stress_categories_batch(check_ins)):
+        ml_results[index] = ml_result
+
+    return [
+        analyze_stress(data, ml_result=ml_result)
+        for data, ml_result in zip(payloads, ml_results)
+    ]
+
+@rule_engine_timer('stress')
+def analyze_stress(data, ml_result=ML_NOT_COMPUTED, trends=None):
     """
     Analyze stress and provide personalized recommendations based on user data.
     Uses ML model if available, falls back to rule-based logic.
+    ml_result can be passed in when the prediction was already computed in a batch,
+    trends when they come from stored state (see incremental_trends) instead of daily_logs.
     """
     try:
-        logger.info("Starting stress analysis with data: %s", data)
+        logger.info("Starting stress analysis with data: %s", data, extra=_PAYLOAD)
         
         user_data = data.get('user_data', {})
         daily_logs = data.get('daily_logs', [])
         current_check_in = data.get('current_check_in')
 
-        logger.info("Extracted components - User data: %s, Daily logs: %s, Current check-in: %s", 
-                   user_data, daily_logs, current_check_in)
+        logger.info("Extracted components - User data: %s, Daily logs: %s, Current check-in: %s",
+                    user_data, daily_logs, current_check_in, extra=_PAYLOAD)
 
-        # Get user profile data
-        date_of_birth = user_data.get('dateOfBirth')
-        gender = user_data.get('gender', 'other')
-        
-        # Calculate age from date of birth
-        age = calculate_age(date_of_birth)
+        # Get user profile data - parsed once per (dateOfBirth, gender) per day
+        profile = get_profile(user_data)
+        gender = profile.gender
+        age = profile.age
 
         # Get current metrics - Use most recent log if available
-        if current_check_in:
-            # Use the provided current check-in data
-            mood = current_check_in.get('mood') or 'neutral'
-            stress_level = current_check_in.get('stressLevel') or 5
-            sleep_quality = current_check_in.get('sleepQuality') or 5
-            notes = current_check_in.get('notes', '')
-        elif daily_logs:
-            # If no current check-in but we have logs, use the most recent log
-            most_recent = daily_logs[0]
-            mood = most_recent.get('mood') or 'neutral'
-            stress_level = most_recent.get('stressLevel') or 5
-            sleep_quality = most_recent.get('sleepQuality') or 5
-            notes = most_recent.get('notes', '')
-        else:
-            # Only use defaults if we have no data at all
-            mood = 'neutral'
-            stress_level = 5
-            sleep_quality = 5
-            notes = ''
+        mood, stress_level, sleep_quality, notes = _current_metrics(data)
 
-        logger.info("Processed user metrics - Age: %s, Gender: %s, Mood: %s, Stress: %s, Sleep: %s", 
-                   age, gender, mood, stress_level, sleep_quality)
+        logger.info("Processed user metrics - Age: %s, Gender: %s, Mood: %s, Stress: %s, Sleep: %s",
+                    age, gender, mood, stress_level, sleep_quality, extra=_PAYLOAD)
 
         # Try to get ML-based stress category
-        ml_result = get_ml_stress_category(mood, stress_level, sleep_quality)
-
-        # Analyze patterns
-        stress_pattern = analyze_stress_pattern(daily_logs)
-        sleep_pattern = analyze_sleep_pattern(daily_logs)
-        mood_pattern = analyze_mood_pattern(daily_logs)
-
-        logger.info("Analyzed patterns - Stress: %s, Sleep: %s, Mood: %s", 
-                   stress_pattern, sleep_pattern, mood_pattern)
+        if ml_result is ML_NOT_COMPUTED:
+            ml_result = get_ml_stress_category(mood, stress_level, sleep_quality)
+
+        # Analyze patterns - logs are parsed once and all three trends computed together
+        try:
+            if trends is None:
+                trends = analyze_trends(daily_logs)
+        except Exception as e:
+            logger.error("Error analyzing check-in trends: %s", str(e))
+            trends = {name: empty_trend() for name in ('stress', 'sleep', 'mood')}
+        stress_pattern = trends['stress']
+        sleep_pattern = trends['sleep']
+        mood_pattern = trends['mood']
+
+        logger.info("Analyzed patterns - Stress: %s, Sleep: %s, Mood: %s",
+                    stress_pattern, sleep_pattern, mood_pattern, extra=_PAYLOAD)
 
         # Generate recommendations based on current state and patterns
         recommendations = []
@@ -401,21 +304,21 @@ def analyze_stress(data):
 
         # Age-specific recommendations
         if age is not None:
-            if age < 25:
+            if profile.age_group == 'young_adult':
                 recommendations.extend([
                     "Young adult specific tips:",
                     "- Balance academic/work pressure with social activities",
                     "- Maintain regular sleep schedule despite high energy levels",
                     "- Learn to set healthy boundaries"
                 ])
-            elif age >= 25 and age < 40:
+            elif profile.age_group == 'adult':
                 recommendations.extend([
                     "Career-age specific tips:",
                     "- Practice work-life balance",
                     "- Schedule regular exercise despite busy schedule",
                     "- Make time for hobbies and personal growth"
                 ])
-            elif age >= 40:
+            elif profile.age_group == 'mid_life':
                 recommendations.extend([
                     "Mid-life specific tips:",
                     "- Practice stress-reducing activities like yoga or tai chi",
@@ -0,0 +1,465 @@
+"""
+Trend Engine - Single-pass trend analysis of daily check-in logs
+The logs are parsed once into columnar NumPy arrays (check-in time, stress, sleep,
+mood code). Time-decay weights, weighted averages, weighted standard deviations and
+weighted least-squares slopes for all three metrics are then computed together.
+Averages and volatility match the per-metric np.average analysis they replace. The
+slope is the exact weighted least-squares fit np.polyfit was asked for; they differ
+only on exact threshold ties and when one check-in outweighs all others by ~1e14,
+where polyfit's scaled lstsq solve returned rounding noise.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Mood scale used for trends - higher is better
+MOOD_CODES = {
+    'happy': 3,
+    'neutral': 2,
+    'anxious': 1,
+    'sad': 0
+}
+
+# How one metric is read from a log and turned into a trend
+# decay: weight = decay ** days_ago; volatility_bands: weighted std upper bounds for
+# 'consistent' / 'moderate'; labels: (rising, falling) names for slopes beyond the threshold
+TrendMetric = namedtuple('TrendMetric', [
+    'name', 'decay', 'volatility_bands', 'slope_threshold', 'labels', 'precision'
+])
+
+STRESS = TrendMetric('stress', 0.8, (0.8, 1.5), 0.5, ('increasing', 'decreasing'), 1)
+SLEEP = TrendMetric('sleep', 0.75, (0.8, 1.5), 0.4, ('improving', 'declining'), 1)
+MOOD = TrendMetric('mood', 0.8, (0.5, 0.8), 0.25, ('improving', 'declining'), 2)
+METRICS = (STRESS, SLEEP, MOOD)
+
+_DECAYS = np.array([metric.decay for metric in METRICS])[:, np.newaxis]
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_DAY = np.timedelta64(1, 'D')
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def empty_trend(volatility='unknown'):
+    """Result for a metric without enough usable data"""
+    return {'trend': 'neutral', 'data_sufficient': False, 'volatility': volatility}
+
+
+def _parse_date(value):
+    """ISO check-in date; unparseable dates count as 'now', like the original analysis"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return datetime.now()
+
+
+class CheckInColumns:
+    """
+    daily_logs as columns: when (datetime64[us]), days_ago (int), and values with one
+    row per metric in METRICS order. valid[i] is False when metric i had a missing or
+    non-numeric value in any log, which invalidates that metric only.
+    """
+    def __init__(self, when, values, valid):
+        self.when = when
+        self.values = values
+        self.valid = valid
+        if when is None:
+            # Mixed naive and timezone-aware dates cannot be ordered - weigh every log equally
+            self.days_ago = np.zeros(values.shape[1], dtype=np.int64)
+        else:
+            self.days_ago = (when.max() - when) // _ONE_DAY
+
+    @classmethod
+    def from_logs(cls, logs):
+        """Parse a list of check-in dicts in a single pass"""
+        dates = [_parse_date(log.get('date', '')) for log in logs]
+        aware = {date.tzinfo is not None for date in dates}
+        if len(aware) == 1:
+            epoch = _EPOCH_UTC if aware.pop() else _EPOCH
+            when = np.array([(date - epoch) // _MICROSECOND for date in dates], dtype='datetime64[us]')
+        else:
+            when = None
+
+        columns = (
+            [log.get('stressLevel', 5) for log in logs],
+            [log.get('sleepQuality', 5) for log in logs],
+            [MOOD_CODES.get(log.get('mood', 'neutral'), 2) for log in logs]
+        )
+        values = np.zeros((len(METRICS), len(logs)), dtype=np.float64)
+        valid = np.zeros(len(METRICS), dtype=bool)
+        for row, column in enumerate(columns):
+            # Anything but plain numbers (None, strings, nested values) invalidates the metric
+            try:
+                parsed = np.asarray(column)
+            except ValueError:
+                continue
+            if parsed.ndim == 1 and parsed.dtype.kind in 'biuf' and np.isfinite(parsed).all():
+                values[row] = parsed
+                valid[row] = True
+        return cls(when, values, valid)
+
+    def statistics(self):
+        """
+        Weighted mean, weighted std and weighted least-squares slope (against log index)
+        per metric, as three arrays. The slope minimizes sum((w * (y - a*x - b)) ** 2),
+        as np.polyfit(x, y, 1, w=weights) does.
+        """
+        weights = _DECAYS ** self.days_ago[np.newaxis, :]
+        # Normalized first, as the per-metric analysis did, so rounding ties land the same way
+        weights = weights / weights.sum(axis=1)[:, np.newaxis]
+        total = weights.sum(axis=1)
+        mean = (weights * self.values).sum(axis=1) / total
+        deviation = self.values - mean[:, np.newaxis]
+        std = np.sqrt((weights * deviation ** 2).sum(axis=1) / total)
+
+        n = self.values.shape[1]
+        fit_weights = weights ** 2
+        fit_total = fit_weights.sum(axis=1)
+        x = np.arange(n, dtype=np.float64)
+        x_centered = x[np.newaxis, :] - ((fit_weights * x).sum(axis=1) / fit_total)[:, np.newaxis]
+        y_centered = self.values - ((fit_weights * self.values).sum(axis=1) / fit_total)[:, np.newaxis]
+        spread = (fit_weights * x_centered ** 2).sum(axis=1)
+        covariance = (fit_weights * x_centered * y_centered).sum(axis=1)
+        # Every weight but one can underflow to zero on very long histories: no trend then
+        slope = np.divide(covariance, spread, out=np.zeros_like(covariance), where=spread > 0)
+        return mean, std, slope
+
+
+def _describe(metric, mean, std, slope, n_logs):
+    low, high = metric.volatility_bands
+    if std < low:
+        volatility = 'consistent'
+    elif std < high:
+        volatility = 'moderate'
+    else:
+        volatility = 'fluctuating'
+
+    rising, falling = metric.labels
+    if slope > metric.slope_threshold:
+        trend = rising
+    elif slope < -metric.slope_threshold:
+        trend = falling
+    else:
+        trend = 'stable'
+
+    return {
+        'trend': trend,
+        'data_sufficient': n_logs >= 3,
+        'volatility': volatility,
+        'weighted_avg': round(mean, metric.precision)
+    }
+
+
+def analyze_trends(logs):
+    """
+    Analyze stress, sleep and mood trends of daily_logs in one pass.
+    Returns {'stress': {...}, 'sleep': {...}, 'mood': {...}}.
+    """
+    if not logs:
+        return {metric.name: empty_trend() for metric in METRICS}
+    # Need at least 2 logs for any trend analysis
+    if len(logs) < 2:
+        return {metric.name: empty_trend('insufficient') for metric in METRICS}
+    if not all(isinstance(log, dict) for log in logs):
+        return {metric.name: empty_trend() for metric in METRICS}
+
+    columns = CheckInColumns.from_logs(logs)
+    mean, std, slope = columns.statistics()
+    return {
+        metric.name: _describe(metric, mean[i], std[i], slope[i], len(logs)) if columns.valid[i] else empty_trend()
+        for i, metric in enumerate(METRICS)
+    }
+
+
+# Columns of TrendState.sums, one row per metric. Mean/variance use the decay weights
+# w; the slope uses w ** 2 and the log index x (0 = newest), as statistics() does.
+_W, _SY, _SYY, _F, _FX, _FXX, _FY, _FXY = range(8)
+_MICROS_PER_DAY = 86400 * 10 ** 6
+
+
+def _timestamp(value):
+    """Check-in date as UTC microseconds since the epoch; naive dates are taken as UTC"""
+    date = _parse_date(value) if value else datetime.now(timezone.utc)
+    epoch = _EPOCH_UTC if date.tzinfo is not None else _EPOCH
+    return (date - epoch) // _MICROSECOND
+
+
+class TrendState:
+    """
+    Exponentially decayed sufficient statistics of a user's check-ins: enough to give the
+    weighted mean, variance and slope of analyze_trends without the history.
+
+    add_check_in() folds one new check-in in O(1): existing weights decay by the days
+    since the previous newest check-in, every log index moves up by one (x -> x + 1
+    expands in closed form over the running sums) and the check-in enters at x = 0 with
+    weight 1. Ages are whole UTC calendar days rather than the elapsed-time days of
+    analyze_trends, so the two can disagree for check-ins less than a day apart.
+    """
+    # Bumped when the layout of sums changes; stored states of another version are rebuilt
+    VERSION = 1
+
+    def __init__(self, sums=None, counts=None, newest=None):
+        self.sums = np.zeros((len(METRICS), 8)) if sums is None else sums
+        self.counts = np.zeros(len(METRICS), dtype=np.int64) if counts is None else counts
+        self.newest = newest  # timestamp of the newest check-in folded in
+
+    @classmethod
+    def from_logs(cls, logs):
+        """Seed a state from a full daily_logs history, folding the oldest check-in first"""
+        state = cls()
+        dated = sorted(
+            ((_timestamp(log.get('date')), log) for log in logs or [] if isinstance(log, dict)),
+            key=lambda item: item[0]
+        )
+        for timestamp, log in dated:
+            state.fold(timestamp, log)
+        return state
+
+    def to_record(self):
+        """(newest, blob) for storage"""
+        return self.newest, np.concatenate([self.sums.ravel(), self.counts]).astype(np.float64).tobytes()
+
+    @classmethod
+    def from_record(cls, newest, blob):
+        flat = np.frombuffer(blob, dtype=np.float64)
+        size = len(METRICS) * 8
+        return cls(flat[:size].reshape(len(METRICS), 8).copy(), flat[size:].astype(np.int64), newest)
+
+    def add_check_in(self, check_in):
+        """
+        Fold in a check-in newer than every one seen so far. Returns False (state
+        unchanged) for a check-in that is not newer - a retried request counts once.
+        """
+        timestamp = _timestamp(check_in.get('date'))
+        if self.newest is not None and timestamp <= self.newest:
+            return False
+        self.fold(timestamp, check_in)
+        return True
+
+    def fold(self, timestamp, log):
+        """Add one check-in as the newest log (x = 0)"""
+        sums = self.sums
+        if self.newest is not None:
+            age = max(0, timestamp // _MICROS_PER_DAY - self.newest // _MICROS_PER_DAY)
+            decay = _DECAYS[:, 0] ** age
+            sums[:, _W:_F] *= decay[:, np.newaxis]
+            sums[:, _F:] *= (decay ** 2)[:, np.newaxis]
+            # sum f*(x+1)^2 = Fxx + 2*Fx + F, sum f*(x+1) = Fx + F, sum f*(x+1)*y = Fxy + Fy
+            sums[:, _FXX] += 2 * sums[:, _FX] + sums[:, _F]
+            sums[:, _FX] += sums[:, _F]
+            sums[:, _FXY] += sums[:, _FY]
+        self.newest = timestamp if self.newest is None else max(self.newest, timestamp)
+
+        for row, value in enumerate((
+            log.get('stressLevel', 5),
+            log.get('sleepQuality', 5),
+            MOOD_CODES.get(log.get('mood', 'neutral'), 2)
+        )):
+            # A missing or non-numeric value leaves a gap for that metric only
+            if isinstance(value, (int, float)) and np.isfinite(value):
+                sums[row, _W] += 1.0
+                sums[row, _SY] += value
+                sums[row, _SYY] += value * value
+                sums[row, _F] += 1.0
+                sums[row, _FY] += value
+                self.counts[row] += 1
+
+    def trends(self):
+        """Same shape as analyze_trends: {'stress': {...}, 'sleep': {...}, 'mood': {...}}"""
+        result = {}
+        for i, metric in enumerate(METRICS):
+            w, sy, syy, f, fx, fxx, fy, fxy = self.sums[i]
+            if self.counts[i] == 0 or w <= 0:
+                result[metric.name] = empty_trend()
+                continue
+            if self.counts[i] < 2:
+                result[metric.name] = empty_trend('insufficient')
+                continue
+            mean = sy / w
+            std = np.sqrt(max(syy / w - mean * mean, 0.0))
+            spread = f * fxx - fx * fx
+            # The spread cancels to rounding error once only one check-in still carries weight
+            slope = (f * fxy - fx * fy) / spread if spread > 1e-12 * f * fxx else 0.0
+            result[metric.name] = _describe(metric, mean, std, slope, int(self.counts[i]))
+        return result
+
+
+_NUMERIC_TYPES = {int, float, bool, type(None)}
+
+
+def _float_column(raw):
+    """Values as float64 with NaN for missing or non-numeric entries"""
+    if set(map(type, raw)) <= _NUMERIC_TYPES:
+        return np.array(raw, dtype=np.float64)  # None -> NaN
+    return np.array([float(v) if isinstance(v, (int, float)) else np.nan for v in raw], dtype=np.float64)
+
+
+class CohortColumns:
+    """
+    Check-ins of many users as one segmented column set: user u owns positions
+    offsets[u]:offsets[u + 1] of when (UTC microseconds) and values (one row per metric,
+    NaN where a log had no usable value). statistics() reduces every user's segment at
+    once with np.*.reduceat, giving the numbers analyze_trends gives per user up to
+    summation order: reduceat adds a segment up in a different order than the per-user
+    sums, so the unrounded statistics can differ by a few ulps and a weighted_avg that
+    lands on a rounding tie can come out one rounding step (10 ** -precision) apart.
+    """
+    def __init__(self, when, values, offsets, user_ids=None, mixed=None, malformed=None, log_counts=None):
+        self.when = np.asarray(when, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        n_users = len(self.offsets) - 1
+        self.user_ids = list(range(n_users)) if user_ids is None else list(user_ids)
+        # mixed: naive and timezone-aware dates (weighed equally, as in analyze_trends);
+        # malformed: daily_logs with a non-dict entry (no trends, as in analyze_trends), which
+        # keep their log count in log_counts but no positions in the columns
+        self.mixed = np.zeros(n_users, dtype=bool) if mixed is None else np.asarray(mixed, dtype=bool)
+        self.malformed = np.zeros(n_users, dtype=bool) if malformed is None else np.asarray(malformed, dtype=bool)
+        self.log_counts = self.lengths if log_counts is None else np.asarray(log_counts, dtype=np.int64)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @classmethod
+    def from_users(cls, users):
+        """users: iterable of (user_id, daily_logs) - logs newest first, as /api/stress takes them"""
+        user_ids, offsets, malformed, log_counts = [], [0], [], []
+        logs = []
+        for user_id, user_logs in users:
+            user_logs = user_logs if isinstance(user_logs, list) else []
+            bad = not all(isinstance(log, dict) for log in user_logs)
+            user_ids.append(user_id)
+            log_counts.append(len(user_logs))
+            malformed.append(bad)
+            if not bad:
+                logs.extend(user_logs)
+            offsets.append(len(logs))
+
+        dates = [_parse_date(log.get('date', '')) for log in logs]
+        aware = np.fromiter((date.tzinfo is not None for date in dates), dtype=bool, count=len(dates))
+        when = np.fromiter(
+            ((date - (_EPOCH_UTC if date.tzinfo is not None else _EPOCH)) // _MICROSECOND for date in dates),
+            dtype=np.int64, count=len(dates)
+        )
+        values = np.array([
+            _float_column([log.get('stressLevel', 5) for log in logs]),
+            _float_column([log.get('sleepQuality', 5) for log in logs]),
+            _float_column([MOOD_CODES.get(log.get('mood', 'neutral'), 2) for log in logs])
+        ]).reshape(len(METRICS), len(logs))
+
+        offsets = np.array(offsets, dtype=np.int64)
+        mixed = np.zeros(len(user_ids), dtype=bool)
+        present = np.diff(offsets) > 0
+        if present.any():
+            starts = offsets[:-1][present]
+            mixed[present] = np.logical_or.reduceat(aware, starts) & ~np.logical_and.reduceat(aware, starts)
+        return cls(when, values, offsets, user_ids, mixed, malformed, log_counts)
+
+    @classmethod
+    def from_padded(cls, when, values, lengths, user_ids=None):
+        """
+        when: (users, max_logs) datetime64 or int64 UTC microseconds; values:
+        (metrics, users, max_logs); lengths: logs per user. Row u uses its first lengths[u]
+        entries, newest first.
+        """
+        when = np.asarray(when)
+        if np.issubdtype(when.dtype, np.datetime64):
+            when = when.astype('datetime64[us]').astype(np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        mask = np.arange(when.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(when[mask], np.asarray(values, dtype=np.float64)[:, mask], offsets, user_ids)
+
+    def statistics(self):
+        """
+        Weighted mean, weighted std and weighted slope per metric and user, as three
+        (metrics, users) arrays, plus a (metrics, users) validity mask. Users without logs
+        get zeros.
+        """
+        n_users = len(self.user_ids)
+        lengths = self.lengths
+        present = lengths > 0
+        starts = self.offsets[:-1][present]
+        mean = np.zeros((len(METRICS), n_users))
+        std = np.zeros_like(mean)
+        slope = np.zeros_like(mean)
+        valid = np.zeros_like(mean, dtype=bool)
+        if not len(starts):
+            return mean, std, slope, valid
+
+        def segment_sum(array):
+            return np.add.reduceat(array, starts, axis=-1)
+
+        # Position -> index among present users, to spread per-user values back over logs
+        segment = np.repeat(np.arange(len(starts)), lengths[present])
+        missing = np.isnan(self.values)
+        values = np.where(missing, 0.0, self.values)
+
+        newest = np.maximum.reduceat(self.when, starts)
+        days_ago = (newest[segment] - self.when) // _MICROS_PER_DAY
+        days_ago[self.mixed[present][segment]] = 0
+        weights = _DECAYS ** days_ago[np.newaxis, :]
+        weights = weights / segment_sum(weights)[:, segment]
+        total = segment_sum(weights)
+        seg_mean = segment_sum(weights * values) / total
+        deviation = values - seg_mean[:, segment]
+        seg_std = np.sqrt(segment_sum(weights * deviation ** 2) / total)
+
+        x = (np.arange(len(self.when)) - np.repeat(starts, lengths[present])).astype(np.float64)
+        fit_weights = weights ** 2
+        fit_total = segment_sum(fit_weights)
+        x_centered = x[np.newaxis, :] - (segment_sum(fit_weights * x) / fit_total)[:, segment]
+        y_centered = values - (segment_sum(fit_weights * values) / fit_total)[:, segment]
+        spread = segment_sum(fit_weights * x_centered ** 2)
+        covariance = segment_sum(fit_weights * x_centered * y_centered)
+
+        mean[:, present] = seg_mean
+        std[:, present] = seg_std
+        slope[:, present] = np.divide(covariance, spread, out=np.zeros_like(covariance), where=spread > 0)
+        valid[:, present] = ~np.logical_or.reduceat(missing, starts, axis=1)
+        return mean, std, slope, valid
+
+    def describe(self):
+        """analyze_trends output per user: [{'user_id': ..., 'stress': {...}, 'sleep': {...}, 'mood': {...}}]"""
+        mean, std, slope, valid = self.statistics()
+        columns = []
+        for i, metric in enumerate(METRICS):
+            low, high = metric.volatility_bands
+            rising, falling = metric.labels
+            columns.append((
+                np.where(std[i] < low, 'consistent', np.where(std[i] < high, 'moderate', 'fluctuating')).tolist(),
+                np.where(slope[i] > metric.slope_threshold, rising,
+                         np.where(slope[i] < -metric.slope_threshold, falling, 'stable')).tolist(),
+                np.round(mean[i], metric.precision).tolist()
+            ))
+
+        results = []
+        for u, user_id in enumerate(self.user_ids):
+            n_logs = int(self.log_counts[u])
+            result = {'user_id': user_id}
+            for i, metric in enumerate(METRICS):
+                if n_logs == 0:
+                    result[metric.name] = empty_trend()
+                elif n_logs < 2:
+                    result[metric.name] = empty_trend('insufficient')
+                elif self.malformed[u] or not valid[i, u]:
+                    result[metric.name] = empty_trend()
+                else:
+                    volatility, trend, average = columns[i]
+                    result[metric.name] = {
+                        'trend': trend[u],
+                        'data_sufficient': n_logs >= 3,
+                        'volatility': volatility[u],
+                        'weighted_avg': average[u]
+                    }
+            results.append(result)
+        return results
+
+
+def analyze_cohort(users):
+    """
+    analyze_trends for many users in one vectorized pass.
+    users: iterable of (user_id, daily_logs); returns one result dict per user, in order.
+    """
+    return CohortColumns.from_users(users).describe()
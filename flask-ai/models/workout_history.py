@@ -0,0 +1,95 @@
+"""
+Workout History - Date-sorted index over a user's workout_history
+Workouts are parsed and sorted by date once. Calendar-window aggregates (volume,
+frequency, per-activity counts over the last 7/28/90 days) are then two bisects and a
+prefix-sum difference each, however long the history is.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+# Calendar windows reported with every workout analysis, in days
+WINDOWS = (7, 28, 90)
+# A workout this recent means the user should rest before the next one
+RECOVERY_PERIOD = timedelta(hours=24)
+
+
+def _parse_date(value):
+    """Workout date as a naive datetime (timezone dropped, as the recovery check does), or None"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _duration(workout):
+    duration = workout.get('duration', 0)
+    return duration if isinstance(duration, (int, float)) else 0
+
+
+class WorkoutHistory:
+    """
+    workout_history sorted by date. Workouts without a parseable date are left out
+    of the index: they can't be placed in a calendar window.
+    """
+    def __init__(self, workouts):
+        dated = []
+        for workout in workouts or []:
+            if not isinstance(workout, dict):
+                continue
+            date = _parse_date(workout.get('date'))
+            if date is not None:
+                dated.append((date, workout))
+        dated.sort(key=lambda item: item[0])
+
+        self.dates = [date for date, _ in dated]
+        self.workouts = [workout for _, workout in dated]
+        # _volume[i] = total duration of the i oldest workouts
+        self._volume = [0] + list(accumulate(_duration(workout) for workout in self.workouts))
+        # Activity -> index positions of its workouts (ascending, since the index is sorted)
+        self._positions = defaultdict(list)
+        for position, workout in enumerate(self.workouts):
+            self._positions[workout.get('activityType', '')].append(position)
+
+    def __len__(self):
+        return len(self.workouts)
+
+    def _bounds(self, days, now):
+        """Index range of workouts dated within the `days` days up to now"""
+        return bisect_right(self.dates, now - timedelta(days=days)), bisect_right(self.dates, now)
+
+    def window(self, days, now=None):
+        """Volume, frequency and per-activity counts of the last `days` calendar days"""
+        now = now or datetime.now()
+        lo, hi = self._bounds(days, now)
+        activities = {}
+        for activity, positions in self._positions.items():
+            count = bisect_right(positions, hi - 1) - bisect_right(positions, lo - 1)
+            if count:
+                activities[activity] = count
+        return {
+            'total_volume': self._volume[hi] - self._volume[lo],
+            'frequency': hi - lo,
+            'activities': activities
+        }
+
+    def windows(self, now=None):
+        """window() for every entry of WINDOWS, keyed '7d', '28d', ..."""
+        now = now or datetime.now()
+        return {f'{days}d': self.window(days, now) for days in WINDOWS}
+
+    def trained_within(self, period, now):
+        """Whether the most recent workout is less than `period` before now"""
+        return bool(self.dates) and now - self.dates[-1] < period
+
+    def clock_state(self, now):
+        """
+        Everything the analysis reads from the clock: each window's index range and the
+        recovery flag. Two moments with equal clock_state give the same windows and advice.
+        """
+        return [list(self._bounds(days, now)) for days in WINDOWS] + [self.trained_within(RECOVERY_PERIOD, now)]
+
+    def latest(self, count=1):
+        """The `count` most recent workouts, oldest first"""
+        return self.workouts[-count:] if count else []
@@ -1,41 +1,72 @@
-import numpy as np
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-import joblib
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
 
+from models.model_manager import (
+    LoadedModel, ML_NOT_COMPUTED, model_file_version, predict_record, predict_records, publish_model,
+    published_model
+)
+from models.forest_engine import load_engine
+from models.feature_spec import FeatureSpec, Numeric, OneHot
+from models.prediction_memo import QuantizedMemo, parse_steps
+from models.workout_history import RECOVERY_PERIOD, WorkoutHistory
+from models.profile import DEFAULT_MAX_HEART_RATE, get_profile
+from models.metrics import excluded_from_rules, rule_engine_timer
+
 # Create a logger
 logger = logging.getLogger(__name__)
+# Marks per-request detail records so log_config can sample them
+_PAYLOAD = {'payload': True}
 
 # Get current directory and model path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, 'workout_model.pkl')
 
-# Load model at module level - LAZY LOADING: model is NOT loaded at import time
-_model_data = None
-_model = None
-_feature_names = None
-_model_loaded = False
+# Model inputs, in the order records are passed to the compiled spec
+WORKOUT_FEATURES = FeatureSpec(
+    OneHot('activity', ('Running', 'Walking', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'HIIT')),
+    Numeric('duration'),
+    Numeric('calories_burned'),
+    Numeric('heart_rate')
+)
 
-def load_model():
-    """Load the trained workout model - Returns model data dict or None"""
-    global _model_data, _model, _feature_names, _model_loaded
-    
+# Synthetic workouts scored by model_manager.publish_model() before the model takes traffic
+# (activity_type, duration, calories_burned, heart_rate)
+WARMUP_RECORDS = [
+    ('Running', 30, 300, 150),
+    ('Yoga', 45, 150, 95),
+    ('Cycling', 60, 550, 140),
+    ('Weight Training', 40, 250, 120)
+]
+
+# Nearby workouts get the same prediction - 2 min / 25 kcal / 5 bpm buckets by default
+# (duration, calories_burned, heart_rate); the activity type must match exactly
+_prediction_memo = QuantizedMemo(parse_steps('WORKOUT_MEMO_STEPS', (2, 25, 5)), categorical=(0,))
+
+def load_model(engine=None, reload=False):
+    """
+    Load the trained workout model - Returns model data dict or None
+    engine: 'auto', 'sklearn' or 'compiled' (defaults to the INFERENCE_ENGINE env var)
+    reload: load a fresh copy from disk, warm it and swap it in (the old model serves until then)
+    """
     # Return already loaded model data
-    if _model_loaded and _model_data is not None:
-        return _model_data
+    published = published_model('workout')
+    if published is not None and not reload:
+        return published.info
     
     try:
         if os.path.exists(MODEL_PATH):
             logger.info(f"🔄 Loading workout model from {MODEL_PATH}...")
-            _model_data = joblib.load(MODEL_PATH)
-            _model = _model_data["pipeline"]
-            _feature_names = _model_data["feature_names"]
-            _model_loaded = True
-            logger.info(f"✅ Workout model loaded successfully")
-            return _model_data
+            version = model_file_version(MODEL_PATH)
+            model, feature_names = load_engine(MODEL_PATH, engine, version)
+            feature_spec = WORKOUT_FEATURES.compile(feature_names)
+            info = {"feature_names": feature_names, "engine": model.name, "version": version}
+            loaded = LoadedModel(model, feature_names, feature_spec, info)
+            # Warmed before it takes traffic; on reload, requests in flight keep the old model
+            publish_model('workout', loaded, WARMUP_RECORDS)
+            _prediction_memo.clear()
+            logger.info(f"✅ Workout model loaded successfully ({model.name} engine, version {version})")
+            return info
         else:
             logger.warning(f"Workout model not found at {MODEL_PATH}, using rule-based fallback")
             return None
@@ -46,37 +77,6 @@ def load_model():
 # NOTE: Removed automatic model loading at import time for Render free tier compatibility
 # load_model()  # <-- This was causing timeout issues on Render
 
-def calculate_age(date_of_birth):
-    """Calculate age from date of birth"""
-    if not date_of_birth:
-        logger.warning("No date of birth provided")
-        return None
-    
-    today = datetime.now()
-    logger.info(f"Processing date of birth: {date_of_birth}")
-    
-    try:
-        # Clean the date string by removing timezone info if present
-        clean_date = date_of_birth.split('T')[0] if 'T' in date_of_birth else date_of_birth
-        logger.info(f"Cleaned date: {clean_date}")
-        
-        # Parse the date
-        born = datetime.strptime(clean_date, '%Y-%m-%d')
-        
-        age = today.year - born.year
-        if today.month < born.month or (today.month == born.month and today.day < born.day):
-            age -= 1
-        
-        logger.info(f"Successfully calculated age: {age} from date: {clean_date}")
-        return age
-    except Exception as e:
-        logger.error(f"Error calculating age: {str(e)}")
-        return None
-
-def calculate_max_heart_rate(age):
-    """Calculate maximum heart rate using Tanaka formula"""
-    return 208 - (0.7 * age)
-
 def get_heart_rate_zones(max_hr):
     """Calculate heart rate training zones"""
     return {
@@ -86,65 +86,85 @@ def get_heart_rate_zones(max_hr):
         'vo2max': (max_hr * 0.9, max_hr * 1.0)
     }
 
+@excluded_from_rules
 def get_ml_recommendation(activity_type, duration, calories_burned, heart_rate):
     """Get workout category recommendation from ML model"""
     try:
-        if _model is None:
-            return None
-        
-        # One-hot encode activity type
-        activity_dummies = {}
-        possible_activities = ['Running', 'Walking', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'HIIT']
-        
-        for act in possible_activities:
-            activity_dummies[f'activity_{act}'] = 1 if activity_type == act else 0
-        
-        # Create feature vector
-        features = pd.DataFrame([{
-            **activity_dummies,
-            'duration': duration,
-            'calories_burned': calories_burned,
-            'heart_rate': heart_rate
-        }])
-        
-        # Ensure correct feature order
-        features = features[_feature_names]
-        
-        # Get prediction
-        prediction = _model.predict(features)[0]
-        probabilities = _model.predict_proba(features)[0]
-        
-        logger.info(f"ML prediction: {prediction}, probabilities: {probabilities}")
-        return {
-            'category': prediction,
-            'confidence': float(max(probabilities)),
-            'all_probabilities': dict(zip(_model.classes_, probabilities))
-        }
+        return predict_record('workout', (activity_type, duration, calories_burned, heart_rate), get_ml_recommendations_batch, memo=_prediction_memo, log=logger)
     except Exception as e:
-        logger.error(f"Error getting ML recommendation: {e}")
+        logger.error("Error getting ML recommendation: %s", e)
         return None
 
-def get_workout_recommendations(data):
+def get_prediction_memo_stats():
+    """Hit/miss statistics of the quantized prediction memo"""
+    return _prediction_memo.stats()
+
+def get_ml_recommendations_batch(workouts):
+    """
+    Get workout categories for many workouts with a single predict_proba call.
+    workouts: list of (activity_type, duration, calories_burned, heart_rate) tuples
+    Returns a list of ML result dicts (all None if the model is unavailable).
+    """
+    try:
+        return predict_records('workout', workouts, log=logger)
+    except Exception as e:
+        logger.error("Error getting batch ML recommendations: %s", e)
+        return [None] * len(workouts)
+
+def _current_workout(data):
+    """Extract (activity_type, duration, calories_burned, heart_rate) from a request payload"""
+    current_stats = data.get('current_stats', {})
+    return (
+        current_stats.get('activityType', ''),
+        current_stats.get('duration', 0),
+        current_stats.get('caloriesBurned', 0),
+        current_stats.get('heartRate', 0)
+    )
+
+def get_workout_recommendations_batch(payloads):
+    """
+    Generate workout recommendations for many users at once.
+    All workouts are scored in one model pass, then the rule logic runs per user.
+    """
+    workouts = []
+    scored = []
+    for index, data in enumerate(payloads):
+        try:
+            activity_type, duration, calories_burned, heart_rate = _current_workout(data)
+            workouts.append((activity_type, float(duration), float(calories_burned), float(heart_rate)))
+            scored.append(index)
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.warning("Skipping ML scoring for batch item %d: %s", index, e)
+
+    ml_results = [None] * len(payloads)
+    for index, ml_result in zip(scored, get_ml_recommendations_batch(workouts)):
+        ml_results[index] = ml_result
+
+    return [
+        get_workout_recommendations(data, ml_result=ml_result)
+        for data, ml_result in zip(payloads, ml_results)
+    ]
+
+@rule_engine_timer('workout')
+def get_workout_recommendations(data, ml_result=ML_NOT_COMPUTED):
     """
     Generate personalized workout recommendations based on user data and workout history.
     Uses ML model if available, falls back to rule-based logic.
+    ml_result can be passed in when the prediction was already computed in a batch.
     """
     try:
         user_data = data.get('user_data', {})
         workout_history = data.get('workout_history', [])
         current_stats = data.get('current_stats', {})
 
-        # Get user profile data
-        date_of_birth = user_data.get('dateOfBirth')
-        logger.info(f"Received user data: {user_data}")
-        logger.info(f"Date of birth from request: {date_of_birth}")
-        
-        gender = user_data.get('gender', 'other')
-        age = calculate_age(date_of_birth)
-        logger.info(f"Calculated age: {age}, Gender: {gender}")
+        # Get user profile data - parsed once per (dateOfBirth, gender) per day
+        profile = get_profile(user_data)
+        gender = profile.gender
+        age = profile.age
+        logger.info("Calculated age: %s, Gender: %s", age, gender, extra=_PAYLOAD)
 
         # Calculate heart rate zones
-        max_hr = calculate_max_heart_rate(age) if age else 180  # Default if age not available
+        max_hr = profile.max_heart_rate or DEFAULT_MAX_HEART_RATE  # Default if age not available
         hr_zones = get_heart_rate_zones(max_hr)
         
         # Analyze current workout
@@ -155,11 +175,15 @@ def get_workout_recommendations(data):
         workout_count = current_stats.get('workoutCount', 1)
 
         # Try to get ML-based recommendation
-        ml_result = get_ml_recommendation(activity_type, duration, calories_burned, heart_rate)
+        if ml_result is ML_NOT_COMPUTED:
+            ml_result = get_ml_recommendation(activity_type, duration, calories_burned, heart_rate)
 
-        # Analyze workout patterns
-        weekly_volume = sum(w.get('duration', 0) for w in workout_history[-7:])
-        workout_frequency = len(workout_history[-7:])
+        # Analyze workout patterns over calendar windows (the last 7 days, not the last 7 entries)
+        history = WorkoutHistory(workout_history)
+        now = datetime.now()
+        history_windows = history.windows(now)
+        weekly_volume = history_windows['7d']['total_volume']
+        workout_frequency = history_windows['7d']['frequency']
 
         # Generate recommendations
         recommendations = []
@@ -175,6 +199,7 @@ def get_workout_recommendations(data):
                 'total_volume': weekly_volume,
                 'frequency': workout_frequency
             },
+            'history_windows': history_windows,
             'heart_rate_zones': hr_zones,
             'profile_data': {
                 'age': age,
@@ -206,7 +231,8 @@ def get_workout_recommendations(data):
 
         # Profile completeness check
         is_profile_complete = bool(age and gender != 'other')
-        logger.info(f"Profile completeness check - Age: {age}, Gender: {gender}, Complete: {is_profile_complete}")
+        logger.info("Profile completeness check - Age: %s, Gender: %s, Complete: %s",
+                    age, gender, is_profile_complete, extra=_PAYLOAD)
 
         if not is_profile_complete:
             if not age:
@@ -315,27 +341,23 @@ def get_workout_recommendations(data):
 
         # Recovery recommendations
         if workout_history:
-            last_workout = workout_history[-1]
+            # Most recent workout by date; list order only when no date could be parsed
+            last_workout = history.latest()[0] if len(history) else workout_history[-1]
             last_workout_type = last_workout.get('activityType', '')
             
             if last_workout_type == activity_type:
                 recommendations.append("Consider varying your workout type for better overall fitness")
             
-            try:
-                # Convert the last workout date to naive datetime
-                last_workout_date = datetime.fromisoformat(last_workout.get('date', '').replace('Z', '+00:00'))
-                last_workout_date = last_workout_date.replace(tzinfo=None)  # Remove timezone info
-                time_since_last = datetime.now() - last_workout_date
-                
-                if time_since_last < timedelta(hours=24):
+            if len(history):
+                if history.trained_within(RECOVERY_PERIOD, now):
                     recommendations.append("Ensure adequate rest between workouts")
-            except (ValueError, TypeError) as e:
-                logger.warning(f"Could not parse workout date: {e}")
+            else:
+                logger.warning("Could not parse workout date: %r", last_workout.get('date'))
                 # Continue without the time-based recommendation
 
         # Progressive overload suggestion
-        if len(workout_history) >= 4:
-            recent_durations = [w.get('duration', 0) for w in workout_history[-4:]]
+        if len(history) >= 4:
+            recent_durations = [w.get('duration', 0) for w in history.latest(4)]
             if all(d >= base_duration for d in recent_durations):
                 recommendations.append("Consider gradually increasing workout intensity")
 
@@ -346,7 +368,7 @@ def get_workout_recommendations(data):
         }
 
     except Exception as e:
-        logger.error(f"Workout recommendation error: {e}")
+        logger.error("Workout recommendation error: %s", e)
         # Only return generic recommendations if profile is incomplete
         if 'is_profile_complete' in locals() and not is_profile_complete:
             return {
@@ -0,0 +1,498 @@
+"""
+Response Cache - Bounded, thread-safe LRU cache with TTL for API responses
+Keys are spread over lock-striped shards so gthread workers don't serialize on one
+lock. Expiry uses time.monotonic() and a per-shard expiry heap that is drained a few
+entries at a time, so get/set/stats stay O(1) amortized as max_size grows.
+
+SharedMemoryCache offers the same interface on a memory-mapped file, so every
+gunicorn worker on a host shares one cache. write_snapshot/read_snapshot let the
+in-process cache survive worker recycling and restarts.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows - only the in-process cache is available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Expired entries removed per get/set/stats call (keeps every call O(1) amortized)
+EXPIRE_BATCH = 8
+
+
+class _Shard:
+    """One lock-protected slice of the cache"""
+    __slots__ = ('lock', 'entries', 'heap', 'capacity', 'hits', 'misses', 'expirations', 'evictions')
+
+    def __init__(self, capacity):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expires_at), oldest use first
+        self.heap = []  # (expires_at, seq, key); stale items are skipped when popped
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+
+class BoundedTTLCache:
+    """LRU cache with TTL and max size to prevent memory unbounded growth"""
+    def __init__(self, max_size=100, ttl_minutes=5, shards=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_minutes * 60
+        if shards is None:
+            # Small caches stay close to exact LRU; large ones get up to 16 stripes
+            shards = min(16, max(1, max_size // 64))
+        capacity = max(1, math.ceil(max_size / shards))
+        self._shards = tuple(_Shard(capacity) for _ in range(shards))
+        self._seq = itertools.count()
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _expire(self, shard, now, budget=EXPIRE_BATCH):
+        """Drop up to budget expired entries from the head of the shard's expiry heap"""
+        removed = 0
+        heap = shard.heap
+        while heap and heap[0][0] <= now and budget > 0:
+            expires_at, _, key = heapq.heappop(heap)
+            entry = shard.entries.get(key)
+            # Only remove if the heap item still describes the live entry
+            if entry is not None and entry[1] == expires_at:
+                del shard.entries[key]
+                shard.expirations += 1
+                removed += 1
+            budget -= 1
+        return removed
+
+    def _compact(self, shard):
+        """Rebuild the heap when overwritten keys have left too many stale items in it"""
+        shard.heap = [(expires_at, next(self._seq), key) for key, (_, expires_at) in shard.entries.items()]
+        heapq.heapify(shard.heap)
+
+    def get(self, key):
+        """Get cached result if not expired - marks it most recently used"""
+        shard = self._shard(key)
+        now = time.monotonic()
+        with shard.lock:
+            self._expire(shard, now)
+            entry = shard.entries.get(key)
+            if entry is None:
+                shard.misses += 1
+                return None
+            result, expires_at = entry
+            if expires_at <= now:
+                del shard.entries[key]
+                shard.expirations += 1
+                shard.misses += 1
+                return None
+            shard.entries.move_to_end(key)
+            shard.hits += 1
+            return result
+
+    def set(self, key, result, ttl_seconds=None):
+        """Cache result - evicts the least recently used entry if the shard is full"""
+        shard = self._shard(key)
+        now = time.monotonic()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with shard.lock:
+            self._expire(shard, now)
+            if key in shard.entries:
+                shard.entries.move_to_end(key)
+            elif len(shard.entries) >= shard.capacity:
+                oldest_key, _ = shard.entries.popitem(last=False)
+                shard.evictions += 1
+                logger.debug("Cache evicted %s (max size reached)", oldest_key)
+            shard.entries[key] = (result, expires_at)
+            heapq.heappush(shard.heap, (expires_at, next(self._seq), key))
+            if len(shard.heap) > 2 * shard.capacity + 64:
+                self._compact(shard)
+
+    def clear(self):
+        """Clear all cached entries"""
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.heap.clear()
+
+    def size(self):
+        """Get current cache size (may include entries not yet swept)"""
+        return sum(len(shard.entries) for shard in self._shards)
+
+    def entries(self):
+        """
+        Live entries as (key, value, expires_at) with expires_at on the wall clock,
+        least recently used first within each shard - used for snapshots.
+        """
+        now = time.monotonic()
+        wall_offset = time.time() - now
+        live = []
+        for shard in self._shards:
+            with shard.lock:
+                live.extend(
+                    (key, value, expires_at + wall_offset)
+                    for key, (value, expires_at) in shard.entries.items()
+                    if expires_at > now
+                )
+        return live
+
+    def load_entries(self, entries):
+        """Insert (key, value, expires_at) entries keeping their remaining TTL; returns the count loaded"""
+        now = time.time()
+        loaded = 0
+        for key, value, expires_at in entries:
+            remaining = expires_at - now
+            if remaining > 0:
+                self.set(key, value, ttl_seconds=remaining)
+                loaded += 1
+        return loaded
+
+    def stats(self):
+        """Get cache statistics - O(shards), with a bounded expiry sweep per shard"""
+        now = time.monotonic()
+        expired = 0
+        totals = {'hits': 0, 'misses': 0, 'expirations': 0, 'evictions': 0}
+        for shard in self._shards:
+            with shard.lock:
+                expired += self._expire(shard, now)
+                totals['hits'] += shard.hits
+                totals['misses'] += shard.misses
+                totals['expirations'] += shard.expirations
+                totals['evictions'] += shard.evictions
+        return {
+            'size': self.size(),
+            'max_size': self.max_size,
+            'ttl_minutes': self.ttl_seconds / 60,
+            'shards': len(self._shards),
+            'expired_cleaned': expired,
+            **totals
+        }
+
+
+# magic, format version, entry count, written at (wall clock)
+_SNAPSHOT_HEADER = struct.Struct('<8sIId')
+# expires_at (wall clock), key length, value length
+_SNAPSHOT_ENTRY = struct.Struct('<dII')
+SNAPSHOT_MAGIC = b'FAISNAP\x00'
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(path, entries):
+    """
+    Atomically write (key, value, expires_at) entries as a compact binary file:
+    a fixed header followed by a zlib-compressed run of length-prefixed records.
+    """
+    body = bytearray()
+    for key, value, expires_at in entries:
+        key_bytes = str(key).encode('utf-8')
+        value_bytes = json.dumps(value, separators=(',', ':'), default=_json_default).encode('utf-8')
+        body += _SNAPSHOT_ENTRY.pack(expires_at, len(key_bytes), len(value_bytes))
+        body += key_bytes
+        body += value_bytes
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(entries), time.time()))
+        f.write(zlib.compress(bytes(body), 1))
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Read entries written by write_snapshot; returns [] for a missing or unreadable file"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, count, _ = _SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring cache snapshot {path} with unknown format")
+            return []
+        body = zlib.decompress(data[_SNAPSHOT_HEADER.size:])
+    except FileNotFoundError:
+        return []
+    except (OSError, struct.error, zlib.error) as e:
+        logger.warning(f"Could not read cache snapshot {path}: {e}")
+        return []
+
+    entries = []
+    offset = 0
+    for _ in range(count):
+        expires_at, key_length, value_length = _SNAPSHOT_ENTRY.unpack_from(body, offset)
+        offset += _SNAPSHOT_ENTRY.size
+        key = body[offset:offset + key_length].decode('utf-8')
+        offset += key_length
+        value = json.loads(body[offset:offset + value_length])
+        offset += value_length
+        entries.append((key, value, expires_at))
+    return entries
+
+
+@contextmanager
+def snapshot_lock(path):
+    """
+    Exclusive lock on <path>.lock for a read-merge-write of the snapshot, so workers
+    exiting together don't each merge into the same old file and overwrite each other.
+    A no-op where fcntl is unavailable.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def default_shared_cache_path():
+    """Prefer tmpfs (/dev/shm) so the cache never touches disk"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'fitness-ai-response-cache')
+
+
+def _json_default(value):
+    """Serialize NumPy scalars that slip into responses"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+# magic, version, n_sets, ways, slot_bytes, entry count
+_FILE_HEADER = struct.Struct('<8sIIIIq')
+# key digest, expires_at (wall clock, shared by all processes), last_used, payload length, in_use
+_SLOT_HEADER = struct.Struct('<16sddII')
+
+
+class SharedMemoryCache:
+    """
+    Cross-worker response cache on a memory-mapped file with fixed-size slots.
+    Slots are grouped into sets of `ways`; a key hashes to one set and replaces the
+    expired or least recently used slot there. Each set is guarded by an fcntl
+    byte-range lock (between processes) plus a striped thread lock (within one).
+    Values are stored as JSON; ones larger than a slot are simply not cached.
+    Hit/miss counters are per process.
+    """
+    MAGIC = b'FAICACHE'
+    VERSION = 1
+
+    def __init__(self, path, max_size=100, ttl_minutes=5, slot_bytes=8192, ways=8):
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryCache requires fcntl (POSIX only)")
+        self.path = path
+        self.max_size = max_size
+        self.ttl_seconds = ttl_minutes * 60
+        self.ways = max(1, min(ways, max_size))
+        self.n_sets = max(1, math.ceil(max_size / self.ways))
+        self.slot_bytes = max(slot_bytes, _SLOT_HEADER.size + 256)
+        self._payload_capacity = self.slot_bytes - _SLOT_HEADER.size
+        self._set_bytes = self.ways * self.slot_bytes
+        self._data_offset = 64
+        self._file_size = self._data_offset + self.n_sets * self._set_bytes
+
+        self._fd = self._open_file()
+        self._mm = mmap.mmap(self._fd, self._file_size)
+
+        self._set_locks = tuple(threading.Lock() for _ in range(min(self.n_sets, 64)))
+        self._header_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expirations': 0, 'evictions': 0, 'oversize': 0}
+
+    def _open_file(self):
+        """
+        Open the file, sizing and stamping it once; later workers attach if the geometry
+        matches. A file with another layout may still be mapped by other workers, and
+        shrinking it would SIGBUS them, so it is never resized in place: a new file is
+        built next to it and renamed over it (existing mappings keep the old inode).
+        """
+        expected = (self.MAGIC, self.VERSION, self.n_sets, self.ways, self.slot_bytes)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    os.close(fd)
+                    continue  # Replaced while we waited for the lock - open the new file
+                size = os.fstat(fd).st_size
+                header = os.pread(fd, _FILE_HEADER.size, 0)
+                if size == self._file_size and len(header) == _FILE_HEADER.size \
+                        and _FILE_HEADER.unpack(header)[:5] == expected:
+                    pass
+                elif size == 0:
+                    # Just created - nobody can have it mapped yet
+                    os.ftruncate(fd, self._file_size)
+                    os.pwrite(fd, _FILE_HEADER.pack(*expected, 0), 0)
+                else:
+                    logger.warning(f"Shared cache at {self.path} has a different layout, replacing it")
+                    self._replace_file(expected)
+                    os.close(fd)
+                    continue
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                return fd
+            except BaseException:
+                os.close(fd)
+                raise
+
+    def _replace_file(self, layout):
+        """Atomically swap in an empty file with this layout (called with the old file flocked)"""
+        directory, name = os.path.split(self.path)
+        fd, temp_path = tempfile.mkstemp(prefix=f'{name}.', dir=directory or None)
+        try:
+            os.ftruncate(fd, self._file_size)
+            os.pwrite(fd, _FILE_HEADER.pack(*layout, 0), 0)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        finally:
+            os.close(fd)
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self._counters[name] += amount
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        return digest, int.from_bytes(digest[:8], 'little') % self.n_sets
+
+    @contextmanager
+    def _locked(self, start, length, thread_lock):
+        with thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _lock_set(self, set_index):
+        start = self._data_offset + set_index * self._set_bytes
+        return self._locked(start, self._set_bytes, self._set_locks[set_index % len(self._set_locks)])
+
+    def _adjust_size(self, delta):
+        with self._locked(0, _FILE_HEADER.size, self._header_lock):
+            fields = _FILE_HEADER.unpack_from(self._mm, 0)
+            _FILE_HEADER.pack_into(self._mm, 0, *fields[:5], max(0, fields[5] + delta))
+
+    def _slot_offset(self, set_index, way):
+        return self._data_offset + set_index * self._set_bytes + way * self.slot_bytes
+
+    def get(self, key):
+        """Get cached result if not expired - marks it most recently used"""
+        digest, set_index = self._locate(key)
+        now = time.time()
+        payload = None
+        expired = False
+        with self._lock_set(set_index):
+            for way in range(self.ways):
+                offset = self._slot_offset(set_index, way)
+                slot_key, expires_at, _, length, in_use = _SLOT_HEADER.unpack_from(self._mm, offset)
+                if not in_use or slot_key != digest:
+                    continue
+                if expires_at <= now:
+                    _SLOT_HEADER.pack_into(self._mm, offset, b'', 0.0, 0.0, 0, 0)
+                    expired = True
+                else:
+                    _SLOT_HEADER.pack_into(self._mm, offset, slot_key, expires_at, now, length, 1)
+                    start = offset + _SLOT_HEADER.size
+                    payload = self._mm[start:start + length]
+                break
+
+        if expired:
+            self._adjust_size(-1)
+            self._count('expirations')
+        if payload is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(payload)
+
+    def set(self, key, result, ttl_seconds=None):
+        """Cache result - replaces the expired or least recently used slot of the key's set"""
+        payload = json.dumps(result, separators=(',', ':'), default=_json_default).encode('utf-8')
+        if len(payload) > self._payload_capacity:
+            self._count('oversize')
+            logger.debug("Response for %s too large for shared cache slot (%d bytes)", key, len(payload))
+            return
+
+        digest, set_index = self._locate(key)
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        outcome = None
+        with self._lock_set(set_index):
+            target = empty = expired = lru = None
+            lru_used = None
+            for way in range(self.ways):
+                slot_key, slot_expires, last_used, _, in_use = _SLOT_HEADER.unpack_from(
+                    self._mm, self._slot_offset(set_index, way)
+                )
+                if in_use and slot_key == digest:
+                    target = way
+                    break
+                if not in_use:
+                    empty = way if empty is None else empty
+                elif slot_expires <= now:
+                    expired = way if expired is None else expired
+                elif lru_used is None or last_used < lru_used:
+                    lru, lru_used = way, last_used
+
+            if target is not None:
+                outcome = 'updated'
+            elif empty is not None:
+                target, outcome = empty, 'inserted'
+            elif expired is not None:
+                target, outcome = expired, 'expirations'
+            else:
+                target, outcome = lru, 'evictions'
+
+            offset = self._slot_offset(set_index, target)
+            start = offset + _SLOT_HEADER.size
+            self._mm[start:start + len(payload)] = payload
+            _SLOT_HEADER.pack_into(self._mm, offset, digest, expires_at, now, len(payload), 1)
+
+        if outcome == 'inserted':
+            self._adjust_size(1)
+        elif outcome in ('expirations', 'evictions'):
+            self._count(outcome)
+
+    def clear(self):
+        """Clear all cached entries (for every worker)"""
+        for set_index in range(self.n_sets):
+            with self._lock_set(set_index):
+                for way in range(self.ways):
+                    _SLOT_HEADER.pack_into(self._mm, self._slot_offset(set_index, way), b'', 0.0, 0.0, 0, 0)
+        with self._locked(0, _FILE_HEADER.size, self._header_lock):
+            fields = _FILE_HEADER.unpack_from(self._mm, 0)
+            _FILE_HEADER.pack_into(self._mm, 0, *fields[:5], 0)
+
+    def size(self):
+        """Entries stored across all workers (expired ones count until replaced or read)"""
+        return _FILE_HEADER.unpack_from(self._mm, 0)[5]
+
+    def stats(self):
+        """Get cache statistics - O(1), read from the shared header and local counters"""
+        with self._counter_lock:
+            counters = dict(self._counters)
+        return {
+            'backend': 'shared',
+            'path': self.path,
+            'size': self.size(),
+            'max_size': self.n_sets * self.ways,
+            'ttl_minutes': self.ttl_seconds / 60,
+            'slot_bytes': self.slot_bytes,
+            'expired_cleaned': 0,
+            **counters
+        }
@@ -6,6 +6,8 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 from sklearn.model_selection import train_test_split
+from models.forest_engine import check_parity, export_artifact
+from models.model_manager import model_file_version
 
 # Set paths for saving models
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -146,14 +148,31 @@ def train_model(X, y, model, model_path, feature_names=None):
         "feature_names": feature_names
     }
     os.makedirs(os.path.dirname(model_path), exist_ok=True)
-    joblib.dump(model_data, model_path)
+    # Written to a temporary file and published last: a running service with hot reload
+    # picks the model up as soon as model_path changes
+    tmp_path = f"{model_path}.tmp"
+    joblib.dump(model_data, tmp_path)
     
     # Print accuracy metrics
     train_score = pipeline.score(X_train, y_train)
     test_score = pipeline.score(X_test, y_test)
-    print(f"✅ Model saved: {model_path}")
     print(f"   Training accuracy: {train_score:.2f}")
     print(f"   Testing accuracy: {test_score:.2f}")
+
+    # Verify the compiled inference engine against sklearn on the training distribution
+    parity = check_parity(pipeline, X)
+    print(f"   Compiled engine parity: {parity['rows'] - parity['label_mismatches']}/{parity['rows']} labels match, "
+          f"max probability diff {parity['max_abs_diff']:.2e}")
+    if not parity['ok']:
+        raise RuntimeError(f"Compiled engine does not match sklearn for {model_path}: {parity}")
+
+    # Export the flattened forest as uncompressed arrays that workers can memory-map
+    version = model_file_version(tmp_path)
+    artifact_dir = export_artifact(pipeline, feature_names, model_path, source_version=version)
+    print(f"   Memory-mappable artifact: {artifact_dir}")
+
+    os.replace(tmp_path, model_path)
+    print(f"✅ Model saved: {model_path} (version {version})")
     
     return {
         "train_score": train_score,
@@ -0,0 +1,66 @@
+"""
+Parity of the cohort trend path (CohortColumns) with per-user analyze_trends.
+Run from flask-ai/: python -m unittest discover tests
+"""
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models.trend_engine import METRICS, CheckInColumns, CohortColumns, analyze_cohort, analyze_trends
+
+MOODS = ['happy', 'neutral', 'anxious', 'sad']
+
+
+def random_users(seed, n_users=3000, max_logs=20):
+    """(user_id, daily_logs) pairs, newest log first, with whole and fractional scores"""
+    rng = random.Random(seed)
+    users = []
+    for user_id in range(n_users):
+        newest = datetime(2024, 1, 1) + timedelta(days=rng.randint(0, 365), hours=rng.randint(0, 23))
+        logs = []
+        for i in range(rng.randint(0, max_logs)):
+            logs.append({
+                'date': (newest - timedelta(days=i, hours=rng.randint(0, 5))).isoformat(),
+                'stressLevel': round(rng.uniform(1, 10), rng.choice([0, 1, 2])),
+                'sleepQuality': round(rng.uniform(1, 10), rng.choice([0, 1, 2])),
+                'mood': rng.choice(MOODS)
+            })
+        users.append((user_id, logs))
+    return users
+
+
+class CohortParityTest(unittest.TestCase):
+    def setUp(self):
+        self.users = random_users(seed=19)
+
+    def test_statistics_match_up_to_summation_order(self):
+        mean, std, slope, valid = CohortColumns.from_users(self.users).statistics()
+        for u, (_, logs) in enumerate(self.users):
+            if len(logs) < 2:
+                continue
+            columns = CheckInColumns.from_logs(logs)
+            expected_mean, expected_std, expected_slope = columns.statistics()
+            np.testing.assert_array_equal(valid[:, u], columns.valid)
+            np.testing.assert_allclose(mean[:, u], expected_mean, rtol=1e-13, atol=1e-13)
+            np.testing.assert_allclose(std[:, u], expected_std, rtol=1e-11, atol=1e-13)
+            np.testing.assert_allclose(slope[:, u], expected_slope, rtol=1e-11, atol=1e-11)
+
+    def test_results_match_except_rounding_ties(self):
+        """Everything is equal except that weighted_avg may be one rounding step apart"""
+        for (user_id, logs), result in zip(self.users, analyze_cohort(self.users)):
+            self.assertEqual(result['user_id'], user_id)
+            expected = analyze_trends(logs)
+            for metric in METRICS:
+                got, want = dict(result[metric.name]), dict(expected[metric.name])
+                got_avg, want_avg = got.pop('weighted_avg', None), want.pop('weighted_avg', None)
+                self.assertEqual(got, want)
+                if want_avg is None:
+                    self.assertIsNone(got_avg)
+                else:
+                    self.assertLessEqual(abs(got_avg - want_avg), 10 ** -metric.precision + 1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Trend Store - Per-user trend state in a local SQLite file
+Each row holds one user's decayed trend statistics (see models.trend_engine.TrendState)
+as an opaque blob, so /api/stress can fold in just the new check-in instead of
+reprocessing the full daily_logs history on every call.
+
+update() runs read-modify-write in one IMMEDIATE transaction, which serializes writers
+across threads and gunicorn workers sharing the file. WAL mode keeps readers unblocked.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_trends (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    newest INTEGER,
+    state BLOB NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class TrendStore:
+    """SQLite-backed map of user_id -> (version, newest, state)"""
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()  # one connection per thread
+        self.reads = 0
+        self.writes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode - transactions are opened explicitly in _transaction()
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def get(self, user_id):
+        """Stored (version, newest, state) for user_id, or None"""
+        row = self._connection().execute(
+            'SELECT version, newest, state FROM user_trends WHERE user_id = ?', (str(user_id),)
+        ).fetchone()
+        self.reads += 1
+        return row
+
+    def update(self, user_id, apply):
+        """
+        Atomically replace a user's record. apply(record) gets the stored
+        (version, newest, state) or None and returns (new_record, result); new_record is
+        a (version, newest, state) tuple to write, or None to leave the row unchanged.
+        Returns result.
+        """
+        with self._transaction() as connection:
+            record = connection.execute(
+                'SELECT version, newest, state FROM user_trends WHERE user_id = ?', (str(user_id),)
+            ).fetchone()
+            self.reads += 1
+            new_record, result = apply(record)
+            if new_record is not None:
+                version, newest, state = new_record
+                connection.execute(
+                    'INSERT OR REPLACE INTO user_trends (user_id, version, newest, state, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (str(user_id), version, newest, state, time.time())
+                )
+                self.writes += 1
+        return result
+
+    def delete(self, user_id):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM user_trends WHERE user_id = ?', (str(user_id),))
+
+    def stats(self):
+        try:
+            users = self._connection().execute('SELECT COUNT(*) FROM user_trends').fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Trend store unavailable: {e}")
+            users = None
+        return {
+            'enabled': True,
+            'path': self.path,
+            'users': users,
+            'reads': self.reads,
+            'writes': self.writes
+        }